@@ -0,0 +1,278 @@
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from config import Config
+from logger import Logger
+from metrics import Metrics
+from render_cache import RenderCache
+from templator import Templator
+
+class Batch:
+    @staticmethod
+    def load_jobs(manifest_path: str) -> List[Dict[str, Any]]:
+        jobs: List[Dict[str, Any]] = []
+        with open(manifest_path, "r", encoding="utf-8") as manifest:
+            for line_no, line in enumerate(manifest, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                job: Dict[str, Any] = {"line": line_no}
+                try:
+                    job["spec"] = json.loads(line)
+                    if not isinstance(job["spec"], dict):
+                        raise ValueError("job must be a json object")
+                except ValueError as e:
+                    Logger.print(f"Invalid job at line {line_no}: {e}", level='error')
+                    job["error"] = f"Invalid job: {e}"
+                jobs.append(job)
+        return jobs
+
+    @staticmethod
+    def prepare_job(spec: Dict[str, Any]) -> Dict[str, Any]:
+        config = Config.prepare_config(
+            report=spec.get("report"),
+            report_path=spec.get("report_path"),
+            path_to_py_module=spec.get("path_to_py_module"),
+            path_to_watermark=spec.get("path_to_watermark"),
+            out=spec.get("output"),
+            data_was_prepared=str(spec.get("data_was_prepared", False)).lower() == "true",
+            params=spec.get("params"),
+            metadata=spec.get("metadata"),
+            stream=spec.get("stream")
+        ) | {"profile": bool(spec.get("profile"))}
+        if spec.get("bundle"):
+            # The bundle gets watermark and metadata once, not every report
+            config |= {"path_to_watermark": None, "metadata": {}, "page_numbers": None}
+        return config
+
+    @staticmethod
+    def fill_job(spec: Dict[str, Any]) -> Dict[str, Any]:
+        # Also runs in worker processes, so it takes and returns plain data
+        started = time.perf_counter()
+        config = Batch.prepare_job(spec)
+        trace = Metrics.start(config)
+        with Metrics.activate(trace):
+            with Metrics.stage("data"):
+                data = Templator.prepare_data(config)
+            cache = RenderCache.get(config.get("render_cache"))
+            cache_key = cache.key(config, data) if cache else None
+            if cache_key:
+                output = Templator.result_path(config)
+                if cache.fetch(cache_key, output):
+                    return {
+                        "config": config,
+                        "output": output,
+                        "cached": True,
+                        "trace": trace,
+                        "elapsed": time.perf_counter() - started
+                    }
+
+            scratch = Templator.make_scratch(config.get("scratch_dir"))
+            try:
+                with Metrics.stage("fill"):
+                    xlsx = Templator.fill(config, scratch, data)
+            except BaseException:
+                shutil.rmtree(scratch, ignore_errors=True)
+                raise
+        return {
+            "config": config,
+            "scratch": scratch,
+            "xlsx": xlsx,
+            "cache_key": cache_key,
+            "trace": trace,
+            "elapsed": time.perf_counter() - started
+        }
+
+    @staticmethod
+    def fill_jobs(jobs: List[Dict[str, Any]], parallel: int) -> None:
+        pending = [job for job in jobs if "error" not in job]
+        if parallel > 1 and len(pending) > 1:
+            Logger.print(f"Fill {len(pending)} templates in {parallel} processes")
+            with ProcessPoolExecutor(parallel, initializer=Logger.setup_logging) as executor:
+                futures = [executor.submit(Batch.fill_job, job["spec"]) for job in pending]
+                # Collected in submission order, whatever order they finish in
+                for job, future in zip(pending, futures):
+                    try:
+                        job.update(future.result())
+                    except Exception as e:
+                        Logger.print(f"Job at line {job['line']} failed: {e}", level='error')
+                        job["error"] = str(e)
+            return
+
+        for job in pending:
+            started = time.perf_counter()
+            try:
+                job.update(Batch.fill_job(job["spec"]))
+            except Exception as e:
+                Logger.print(f"Job at line {job['line']} failed: {e}", level='error')
+                job["error"] = str(e)
+                job["elapsed"] = time.perf_counter() - started
+
+    @staticmethod
+    def convert_jobs(jobs: List[Dict[str, Any]], scratch_dirs: List[str]) -> None:
+        # Only the converter settings split a group, every job is converted
+        # into the shared scratch dir and finalized into its own output
+        groups: Dict[Any, List[Dict[str, Any]]] = {}
+        for job in jobs:
+            config = job["config"]
+            groups.setdefault(
+                (
+                    config.get("libreoffice_path"),
+                    json.dumps(config.get("converter_pool"), sort_keys=True)
+                ),
+                []
+            ).append(job)
+
+        for (libreoffice_path, _), group in groups.items():
+            Logger.print(f"Convert {len(group)} xlsx files to pdf with {libreoffice_path}")
+            started = time.perf_counter()
+            convert_dir = Templator.make_scratch(group[0]["config"].get("scratch_dir"))
+            scratch_dirs.append(convert_dir)
+            try:
+                pdfs = Templator.excell_to_pdf_many(
+                    [job["xlsx"] for job in group],
+                    convert_dir,
+                    libreoffice_path,
+                    group[0]["config"].get("converter_pool")
+                )
+                for job, pdf in zip(group, pdfs):
+                    if os.path.isfile(pdf):
+                        job["pdf"] = pdf
+                    else:
+                        job["error"] = f"Converter did not produce {pdf}"
+            except Exception as e:
+                for job in group:
+                    job["error"] = str(e)
+            finally:
+                elapsed = (time.perf_counter() - started) / len(group)
+                for job in group:
+                    job["elapsed"] += elapsed
+                    # One conversion for the group, each job gets its share
+                    Metrics.record(job.get("trace"), "convert", elapsed, 0.0)
+
+    @staticmethod
+    def bundle_job(job: Dict[str, Any], bundle: Any) -> None:
+        # Cached renders were fetched into the output dir, they are only read from there
+        pdf = job["output"] if job.get("cached") else job["pdf"]
+        spec = job.get("spec") or {}
+        with Metrics.activate(job.get("trace")), Metrics.stage("bundle"):
+            bundle.add(pdf, spec.get("title") or f"{job['config'].get('report_name')} ({job['line']})")
+        if job.get("cached"):
+            os.remove(pdf)
+        elif job.get("cache_key"):
+            RenderCache.get(job["config"].get("render_cache")).store(job["cache_key"], pdf)
+        job["output"] = bundle.output_pdf
+
+    @staticmethod
+    def render_jobs(jobs: List[Dict[str, Any]], parallel: int, bundle: Any = None) -> None:
+        scratch_dirs: List[str] = []
+        try:
+            Batch.fill_jobs(jobs, parallel)
+            scratch_dirs.extend(job["scratch"] for job in jobs if "scratch" in job)
+
+            rendered = [job for job in jobs if "error" not in job and not job.get("cached")]
+            Batch.convert_jobs(rendered, scratch_dirs)
+
+            # A bundle takes every report in manifest order, cached ones too
+            for job in jobs if bundle else rendered:
+                if "error" in job:
+                    continue
+                started = time.perf_counter()
+                try:
+                    if bundle:
+                        Batch.bundle_job(job, bundle)
+                    else:
+                        with Metrics.activate(job.get("trace")), Metrics.stage("finalize"):
+                            job["output"] = Templator.finalize_pdf(job["pdf"], job["config"])
+                        if job.get("cache_key"):
+                            RenderCache.get(job["config"].get("render_cache")) \
+                                .store(job["cache_key"], job["output"])
+                except Exception as e:
+                    Logger.print(f"Job at line {job['line']} failed: {e}", level='error')
+                    job["error"] = str(e)
+                job["elapsed"] += time.perf_counter() - started
+        finally:
+            for scratch in scratch_dirs:
+                shutil.rmtree(scratch, ignore_errors=True)
+
+    @staticmethod
+    def open_bundle(jobs: List[Dict[str, Any]], bundle_path: str) -> Any:
+        from bundle import Bundle
+
+        Config.validate_out_path(os.path.abspath(bundle_path))
+        valid = [job for job in jobs if "error" not in job]
+        # Watermark and metadata of the bundle come from the first job that
+        # prepares, a broken one fails again on its own when it is rendered
+        first: Dict[str, Any] = {}
+        for job in valid:
+            try:
+                first = Batch.prepare_job(job["spec"])
+                break
+            except Exception as e:
+                Logger.print(f"Job at line {job['line']} cannot set up the bundle: {e}", level='warning')
+        for job in valid:
+            job["spec"]["bundle"] = True
+        return Bundle(bundle_path, first.get("path_to_watermark"), first.get("metadata"))
+
+    @staticmethod
+    def run(
+        manifest_path: str,
+        results_path: Optional[str] = None,
+        parallel: int = 1,
+        pipeline: bool = False,
+        bundle_path: Optional[str] = None
+    ) -> str:
+        if not results_path:
+            results_path = f"{os.path.splitext(manifest_path)[0]}.results.jsonl"
+        Config.validate_out_path(os.path.abspath(results_path))
+        if parallel < 1:
+            parallel = os.cpu_count() or 1
+
+        jobs = Batch.load_jobs(manifest_path)
+        Logger.print(f"Start batch of {len(jobs)} jobs from {manifest_path}")
+        for job in jobs:
+            job["elapsed"] = 0.0
+
+        bundle = Batch.open_bundle(jobs, bundle_path) if bundle_path else None
+        try:
+            if pipeline:
+                from pipeline import RenderPipeline
+                RenderPipeline(Config.load_config().get("pipeline"), bundle).run(jobs)
+            else:
+                Batch.render_jobs(jobs, parallel, bundle)
+            if bundle:
+                bundle.close()
+        except BaseException:
+            if bundle:
+                bundle.abort()
+            raise
+
+        failed = 0
+        with open(results_path, "w", encoding="utf-8") as results:
+            for job in jobs:
+                Metrics.finish(
+                    job.get("trace"),
+                    "error" if "error" in job else "ok",
+                    job.get("error")
+                )
+                spec = job.get("spec") or {}
+                result = {
+                    "line": job["line"],
+                    "report": spec.get("report"),
+                    "status": "error" if "error" in job else "ok",
+                    "output": job.get("output"),
+                    "error": job.get("error"),
+                    "cached": bool(job.get("cached")),
+                    "elapsed": round(job["elapsed"], 3)
+                }
+                failed += "error" in job
+                results.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+        Logger.print(f"Finish batch: {len(jobs) - failed} ok, {failed} failed")
+        for path, stats in RenderCache.all_stats().items():
+            Logger.print(f"Render cache {path}: {stats}")
+        return results_path
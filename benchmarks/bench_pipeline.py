@@ -0,0 +1,346 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font
+
+from PyPDF2 import PageObject, PdfWriter
+from PyPDF2.generic import (
+    DecodedStreamObject,
+    DictionaryObject,
+    NameObject
+)
+
+from template_cache import TemplateCache
+from templator import Templator
+from version import __version__
+
+# Axes of a synthetic template:
+#   cells            text cells per sheet
+#   placeholders     scalar {{var_N}} cells per sheet
+#   rows, cols       size of the table inserted at {{table}} on the first sheet
+#   merges           merged ranges below the table anchor (shifted by insert_table)
+#   sheets           sheets in the workbook
+#   pages            pages of the converted pdf
+#   watermark_pages  pages of the watermark pdf (only the first one is stamped)
+SCENARIOS = {
+    "small": {
+        "cells": 200, "placeholders": 20, "rows": 100, "cols": 5,
+        "merges": 10, "sheets": 1, "pages": 2, "watermark_pages": 1
+    },
+    "medium": {
+        "cells": 2000, "placeholders": 200, "rows": 2000, "cols": 10,
+        "merges": 50, "sheets": 3, "pages": 20, "watermark_pages": 1
+    },
+    "large": {
+        "cells": 20000, "placeholders": 1000, "rows": 20000, "cols": 20,
+        "merges": 200, "sheets": 5, "pages": 200, "watermark_pages": 3
+    }
+}
+
+GRID_WIDTH = 10
+
+WATERMARK_CONTENT = (
+    b"q 0.5 g BT /F1 72 Tf 0.7071 0.7071 -0.7071 0.7071 150 250 Tm (DRAFT) Tj ET Q\n"
+    b"q 0.8 G 4 w 20 20 555 802 re S Q\n"
+)
+
+class PipelineBench:
+    @staticmethod
+    def make_template(path: str, axes: Dict[str, int]) -> int:
+        wb = Workbook()
+        grid_rows = -(-axes["cells"] // GRID_WIDTH)
+        step = max(1, axes["cells"] // max(1, axes["placeholders"]))
+        anchor_row = grid_rows + 3
+
+        for sheet_idx in range(axes["sheets"]):
+            sheet = wb.active if sheet_idx == 0 else wb.create_sheet()
+            sheet.title = f"Sheet{sheet_idx + 1}"
+            placed = 0
+            for idx in range(axes["cells"]):
+                row, col = divmod(idx, GRID_WIDTH)
+                if idx % step == 0 and placed < axes["placeholders"]:
+                    value = f"Value: {{{{var_{placed}}}}}"
+                    placed += 1
+                else:
+                    value = f"text {row}:{col}"
+                sheet.cell(row=row + 1, column=col + 1, value=value)
+            if sheet_idx:
+                continue
+
+            for col in range(axes["cols"]):
+                header = sheet.cell(row=anchor_row - 1, column=col + 1, value=f"col_{col}")
+                header.font = Font(bold=True)
+            sheet.cell(row=anchor_row, column=1, value="{{table}}")
+            # Inserted rows take the anchor height, like real templates
+            sheet.row_dimensions[anchor_row].height = 18
+            for idx in range(axes["merges"]):
+                row = anchor_row + 2 + idx * 2
+                sheet.cell(row=row, column=1, value=f"merged {idx}")
+                sheet.merge_cells(start_row=row, start_column=1, end_row=row, end_column=3)
+        wb.save(path)
+        return anchor_row
+
+    @staticmethod
+    def make_params(axes: Dict[str, int]) -> Dict[str, Any]:
+        params: Dict[str, Any] = {
+            f"var_{idx}": f"value {idx}" for idx in range(axes["placeholders"])
+        }
+        params["table"] = {
+            f"col_{col}": [f"{row}.{col}" for row in range(axes["rows"])]
+            for col in range(axes["cols"])
+        }
+        return params
+
+    @staticmethod
+    def make_pdf(path: str, pages: int, content: Optional[bytes] = None) -> None:
+        writer = PdfWriter()
+        for _ in range(pages):
+            # add_page stores a copy, so the page is filled before it is added
+            page = PageObject.create_blank_page(writer, 595, 842)
+            if content:
+                stream = DecodedStreamObject()
+                stream.set_data(content)
+                page[NameObject("/Contents")] = writer._add_object(stream)
+                font = DictionaryObject({
+                    NameObject("/Type"): NameObject("/Font"),
+                    NameObject("/Subtype"): NameObject("/Type1"),
+                    NameObject("/BaseFont"): NameObject("/Helvetica")
+                })
+                page[NameObject("/Resources")] = DictionaryObject({
+                    NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})
+                })
+            writer.add_page(page)
+        with open(path, "wb") as f:
+            writer.write(f)
+
+    @staticmethod
+    def measure(
+        run: Callable[[], None],
+        repeat: int,
+        setup: Optional[Callable[[], Any]] = None
+    ) -> Dict[str, Any]:
+        # One untimed warm-up, then the timed runs; setup is never timed
+        times: List[float] = []
+        for attempt in range(repeat + 1):
+            state = setup() if setup else None
+            started = time.perf_counter()
+            if setup:
+                run(state)
+            else:
+                run()
+            elapsed = time.perf_counter() - started
+            if attempt:
+                times.append(elapsed)
+        return {
+            "runs": repeat,
+            "min": round(min(times), 6),
+            "median": round(statistics.median(times), 6),
+            "mean": round(statistics.fmean(times), 6)
+        }
+
+    @staticmethod
+    def run_scenario(
+        axes: Dict[str, int],
+        repeat: int,
+        libreoffice_path: Optional[str] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        timings: Dict[str, Dict[str, Any]] = {}
+        with tempfile.TemporaryDirectory(prefix="bench_") as work_dir:
+            template = os.path.join(work_dir, "template.xlsx")
+            anchor_row = PipelineBench.make_template(template, axes)
+            params = PipelineBench.make_params(axes)
+            scalars = params | {"table": ""}
+
+            timings["replace_variables_in_sheet"] = PipelineBench.measure(
+                lambda wb: [
+                    Templator.replace_variables_in_sheet(sheet, params)
+                    for sheet in wb.worksheets
+                ],
+                repeat,
+                setup=lambda: load_workbook(template)
+            )
+
+            timings["insert_table"] = PipelineBench.measure(
+                lambda wb: Templator.insert_table(wb.active, anchor_row, 1, params["table"]),
+                repeat,
+                setup=lambda: load_workbook(template)
+            )
+
+            timings["create_xlsx_from_template"] = PipelineBench.measure(
+                lambda: Templator.create_xlsx_from_template(
+                    template, params, work_dir, "filled.xlsx"
+                ),
+                repeat
+            )
+            # The first load only marks the template and the second pickles it,
+            # both happen in the untimed setup so every timed run is a clone
+            template_cache = {"max_bytes": 1 << 30}
+            timings["create_xlsx_from_template[cached]"] = PipelineBench.measure(
+                lambda _: Templator.create_xlsx_from_template(
+                    template, params, work_dir, "filled_cached.xlsx",
+                    template_cache=template_cache
+                ),
+                repeat,
+                setup=lambda: [TemplateCache.load(template, template_cache) for _ in range(2)]
+            )
+            timings["create_xlsx_from_template[xml]"] = PipelineBench.measure(
+                lambda: Templator.create_xlsx_from_template(
+                    template, scalars, work_dir, "filled_xml.xlsx"
+                ),
+                repeat
+            )
+            timings["create_xlsx_from_template[stream]"] = PipelineBench.measure(
+                lambda: Templator.create_xlsx_from_template(
+                    template, params, work_dir, "filled_stream.xlsx", stream=True
+                ),
+                repeat
+            )
+
+            # Conversion is stubbed with a generated pdf unless libreoffice is given
+            converted = os.path.join(work_dir, "filled.pdf")
+            if libreoffice_path:
+                timings["excell_to_pdf"] = PipelineBench.measure(
+                    lambda: Templator.excell_to_pdf(
+                        os.path.join(work_dir, "filled.xlsx"),
+                        work_dir,
+                        libreoffice_path
+                    ),
+                    repeat
+                )
+            else:
+                PipelineBench.make_pdf(converted, axes["pages"])
+
+            watermark = os.path.join(work_dir, "watermark.pdf")
+            PipelineBench.make_pdf(watermark, axes["watermark_pages"], WATERMARK_CONTENT)
+            metadata = {"/Title": "bench", "/Author": "bench"}
+            timings["add_metadata_to_pdf"] = PipelineBench.measure(
+                lambda: Templator.add_metadata_to_pdf(
+                    converted,
+                    os.path.join(work_dir, "final.pdf"),
+                    watermark,
+                    metadata
+                ),
+                repeat
+            )
+            # Without a watermark only an incremental Info update is appended
+            timings["add_metadata_to_pdf[no watermark]"] = PipelineBench.measure(
+                lambda: Templator.add_metadata_to_pdf(
+                    converted,
+                    os.path.join(work_dir, "final_info.pdf"),
+                    None,
+                    metadata
+                ),
+                repeat
+            )
+        return timings
+
+    @staticmethod
+    def compare(
+        results: Dict[str, Any],
+        baseline: Dict[str, Any],
+        threshold: float
+    ) -> List[str]:
+        regressions = []
+        for name, scenario in results["scenarios"].items():
+            base_scenario = baseline.get("scenarios", {}).get(name)
+            if not base_scenario:
+                continue
+            if base_scenario["axes"] != scenario["axes"]:
+                print(f"{name}: axes differ from the baseline, skipped")
+                continue
+            for op, timing in scenario["timings"].items():
+                base = base_scenario["timings"].get(op)
+                if not base or not base["median"]:
+                    continue
+                ratio = timing["median"] / base["median"]
+                flag = "REGRESSION" if ratio > 1 + threshold else ""
+                print(f"{name:>8} {op:<36} {base['median']:>10.4f}s -> {timing['median']:>10.4f}s  x{ratio:.2f} {flag}")
+                if flag:
+                    regressions.append(f"{name}/{op}")
+        return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the template to pdf pipeline")
+    parser.add_argument(
+        "--scenarios",
+        type=str,
+        default="small,medium",
+        help=f"Comma separated presets: {', '.join(SCENARIOS)}"
+    )
+    parser.add_argument(
+        "--set",
+        type=str,
+        action="append",
+        default=[],
+        help="Override an axis for every scenario, e.g. --set rows=50000"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per operation")
+    parser.add_argument("--output", type=str, help="Write results as json to this file")
+    parser.add_argument("--compare", type=str, help="Baseline json to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Median slowdown counted as a regression (0.2 = 20%%)"
+    )
+    parser.add_argument(
+        "--libreoffice_path",
+        type=str,
+        help="Also time the real conversion, otherwise it is stubbed"
+    )
+    args = parser.parse_args()
+
+    overrides = {}
+    for item in args.set:
+        axis, _, value = item.partition("=")
+        if axis not in SCENARIOS["small"] or not value.isdigit():
+            parser.error(f"bad --set {item}")
+        overrides[axis] = int(value)
+
+    results: Dict[str, Any] = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "repeat": args.repeat,
+        "converted": bool(args.libreoffice_path),
+        "scenarios": {}
+    }
+    for name in args.scenarios.split(","):
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+        axes = SCENARIOS[name] | overrides
+        print(f"Running {name}: {axes}")
+        timings = PipelineBench.run_scenario(axes, args.repeat, args.libreoffice_path)
+        results["scenarios"][name] = {"axes": axes, "timings": timings}
+        for op, timing in timings.items():
+            print(f"{name:>8} {op:<36} median {timing['median']:.4f}s  min {timing['min']:.4f}s")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = PipelineBench.compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions over {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from PyPDF2.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    StreamObject,
+    create_string_object
+)
+
+from logger import Logger
+
+class Bundle:
+    # Objects are written to the file as soon as they are copied, only the
+    # xref offsets, the page list and the bookmarks stay in memory
+    def __init__(
+        self,
+        output_pdf: str,
+        watermark_pdf: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None
+    ):
+        self.output_pdf = os.path.abspath(output_pdf)
+        self.partial_pdf = os.path.join(
+            os.path.dirname(self.output_pdf),
+            f".{os.path.basename(self.output_pdf)}.part"
+        )
+        self.metadata = {
+            key if key.startswith("/") else f"/{key}": value
+            for key, value in (metadata or {}).items()
+        }
+        # offsets[n] is where object n starts, None until it is written
+        self.offsets: List[Optional[int]] = [None]
+        self.kids: List[IndirectObject] = []
+        self.bookmarks: List[Tuple[str, IndirectObject]] = []
+        self._lock = threading.Lock()
+
+        self.file = open(self.partial_pdf, "wb")
+        self.file.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self.catalog = self._reserve()
+        self.pages_root = self._reserve()
+        self.outlines = self._reserve()
+        self.stamp = self._import_watermark(watermark_pdf) if watermark_pdf else None
+
+    def _reserve(self) -> IndirectObject:
+        self.offsets.append(None)
+        return IndirectObject(len(self.offsets) - 1, 0, self)
+
+    def _write(self, ref: IndirectObject, obj: Any) -> None:
+        self.offsets[ref.idnum] = self.file.tell()
+        self.file.write(f"{ref.idnum} 0 obj\n".encode("ascii"))
+        obj.write_to_stream(self.file, None)
+        self.file.write(b"\nendobj\n")
+
+    def _copy(self, obj: Any, mapping: Dict[Tuple[int, int], IndirectObject], pending: List[Any]) -> Any:
+        # References of the source get new numbers here, their objects
+        # are copied by _drain
+        if isinstance(obj, IndirectObject):
+            if obj.pdf is self:
+                return obj
+            key = (obj.idnum, obj.generation)
+            if key not in mapping:
+                mapping[key] = self._reserve()
+                pending.append((obj, mapping[key]))
+            return mapping[key]
+        if isinstance(obj, StreamObject):
+            if isinstance(obj, DecodedStreamObject):
+                copied = DecodedStreamObject()
+                copied.set_data(obj.get_data())
+            else:
+                copied = EncodedStreamObject()
+                copied._data = obj._data
+            for key, value in obj.items():
+                # Length is written from the data
+                if key != "/Length":
+                    copied[key] = self._copy(value, mapping, pending)
+            return copied
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({
+                key: self._copy(value, mapping, pending) for key, value in obj.items()
+            })
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._copy(value, mapping, pending) for value in obj)
+        return obj
+
+    def _drain(self, mapping: Dict[Tuple[int, int], IndirectObject], pending: List[Any]) -> None:
+        while pending:
+            source, ref = pending.pop()
+            self._write(ref, self._copy(source.get_object(), mapping, pending))
+
+    def _import_watermark(self, watermark_pdf: str) -> Tuple[IndirectObject, IndirectObject, IndirectObject]:
+        from PyPDF2 import PdfWriter
+
+        from watermark import STAMP_NAME, Watermark
+
+        # Built like Watermark.stamp in a scratch writer, then copied over once
+        writer = PdfWriter()
+        entry = Watermark.load(watermark_pdf)
+        refs = (
+            Watermark.add_form(writer, entry),
+            Watermark.add_stream(writer, b"q\n"),
+            Watermark.add_stream(writer, f"\nQ\nq {STAMP_NAME} Do Q\n".encode("latin-1"))
+        )
+        mapping: Dict[Tuple[int, int], IndirectObject] = {}
+        pending: List[Any] = []
+        form, save_ref, draw_ref = (self._copy(ref, mapping, pending) for ref in refs)
+        self._drain(mapping, pending)
+        return form, save_ref, draw_ref
+
+    def _page(self, page: Any, mapping: Dict[Tuple[int, int], IndirectObject], pending: List[Any]) -> DictionaryObject:
+        from watermark import STAMP_NAME
+
+        copied = DictionaryObject({
+            key: self._copy(value, mapping, pending)
+            for key, value in page.items()
+            if key not in ("/Parent", "/Contents", "/Resources")
+        })
+        copied[NameObject("/Parent")] = self.pages_root
+
+        contents = page.get("/Contents")
+        if contents is None:
+            streams = []
+        elif isinstance(contents.get_object(), ArrayObject):
+            streams = list(contents.get_object())
+        else:
+            streams = [contents]
+        resources = page.get("/Resources")
+        resources = DictionaryObject(resources.get_object()) if resources is not None else DictionaryObject()
+
+        if self.stamp:
+            form, save_ref, draw_ref = self.stamp
+            streams = [save_ref, *streams, draw_ref]
+            xobjects = resources.get("/XObject")
+            xobjects = DictionaryObject(xobjects.get_object()) if xobjects is not None else DictionaryObject()
+            xobjects[NameObject(STAMP_NAME)] = form
+            resources[NameObject("/XObject")] = xobjects
+
+        copied[NameObject("/Contents")] = self._copy(ArrayObject(streams), mapping, pending)
+        copied[NameObject("/Resources")] = self._copy(resources, mapping, pending)
+        return copied
+
+    def add(self, pdf_path: str, title: str) -> int:
+        from PyPDF2 import PdfReader
+
+        with self._lock:
+            # A report that fails half way is cut off again, the bundle
+            # stays as it was before it
+            file_offset = self.file.tell()
+            objects = len(self.offsets)
+            try:
+                # Only one source document is open at a time
+                reader = PdfReader(pdf_path)
+                mapping: Dict[Tuple[int, int], IndirectObject] = {}
+                pending: List[Any] = []
+                refs = []
+                for page in reader.pages:
+                    ref = self._reserve()
+                    refs.append(ref)
+                    # Links and annotations pointing at a page keep pointing at it
+                    if page.indirect_reference is not None:
+                        source = page.indirect_reference
+                        mapping[(source.idnum, source.generation)] = ref
+
+                for page, ref in zip(reader.pages, refs):
+                    self._write(ref, self._page(page, mapping, pending))
+                    self._drain(mapping, pending)
+            except BaseException:
+                self.file.seek(file_offset)
+                self.file.truncate()
+                del self.offsets[objects:]
+                raise
+
+            self.kids.extend(refs)
+            if refs:
+                self.bookmarks.append((title, refs[0]))
+            Logger.print(f"\tAdded {len(refs)} pages of {title} to {self.output_pdf}")
+            return len(refs)
+
+    def close(self) -> str:
+        with self._lock:
+            if not self.kids:
+                Logger.print(f"Bundle {self.output_pdf} has no pages", level='warning')
+            self._write(self.pages_root, DictionaryObject({
+                NameObject("/Type"): NameObject("/Pages"),
+                NameObject("/Kids"): ArrayObject(self.kids),
+                NameObject("/Count"): NumberObject(len(self.kids))
+            }))
+
+            items = [self._reserve() for _ in self.bookmarks]
+            for idx, ((title, page_ref), item) in enumerate(zip(self.bookmarks, items)):
+                bookmark = DictionaryObject({
+                    NameObject("/Title"): create_string_object(title),
+                    NameObject("/Parent"): self.outlines,
+                    NameObject("/Dest"): ArrayObject([page_ref, NameObject("/Fit")])
+                })
+                if idx > 0:
+                    bookmark[NameObject("/Prev")] = items[idx - 1]
+                if idx + 1 < len(items):
+                    bookmark[NameObject("/Next")] = items[idx + 1]
+                self._write(item, bookmark)
+            outlines = DictionaryObject({
+                NameObject("/Type"): NameObject("/Outlines"),
+                NameObject("/Count"): NumberObject(len(items))
+            })
+            if items:
+                outlines[NameObject("/First")] = items[0]
+                outlines[NameObject("/Last")] = items[-1]
+            self._write(self.outlines, outlines)
+
+            self._write(self.catalog, DictionaryObject({
+                NameObject("/Type"): NameObject("/Catalog"),
+                NameObject("/Pages"): self.pages_root,
+                NameObject("/Outlines"): self.outlines,
+                NameObject("/PageMode"): NameObject("/UseOutlines")
+            }))
+            info = self._reserve()
+            self._write(info, DictionaryObject({
+                NameObject(key): create_string_object(str(value))
+                for key, value in self.metadata.items()
+            }))
+
+            xref_offset = self.file.tell()
+            self.file.write(f"xref\n0 {len(self.offsets)}\n0000000000 65535 f\r\n".encode("ascii"))
+            for offset in self.offsets[1:]:
+                self.file.write(f"{offset:010d} 00000 n\r\n".encode("ascii"))
+            self.file.write(b"trailer\n")
+            DictionaryObject({
+                NameObject("/Size"): NumberObject(len(self.offsets)),
+                NameObject("/Root"): self.catalog,
+                NameObject("/Info"): info
+            }).write_to_stream(self.file, None)
+            self.file.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+            self.file.close()
+            # Renamed into place only when complete, like every other result
+            os.replace(self.partial_pdf, self.output_pdf)
+        Logger.print(f"Bundle {self.output_pdf} written with {len(self.kids)} pages")
+        return self.output_pdf
+
+    def abort(self) -> None:
+        with self._lock:
+            if not self.file.closed:
+                self.file.close()
+            if os.path.exists(self.partial_pdf):
+                os.remove(self.partial_pdf)
@@ -0,0 +1,162 @@
+import os
+import queue
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from columnar import Columnar
+from converter_pool import ConverterPool, _file_url
+from logger import Logger
+from metrics import Metrics
+from streaming import Streaming
+
+class Chunked:
+    @staticmethod
+    def chunk_rows(settings: Dict[str, Any]) -> int:
+        # Whole pages only, so no page of the result is cut short in the middle
+        rows_per_page = int(settings.get("rows_per_page") or 0)
+        pages_per_chunk = int(settings.get("pages_per_chunk") or 1)
+        if rows_per_page < 1 or pages_per_chunk < 1:
+            Logger.print("chunked needs rows_per_page and pages_per_chunk above 0", level='critical')
+            raise ValueError("chunked needs rows_per_page and pages_per_chunk above 0")
+        return rows_per_page * pages_per_chunk
+
+    @staticmethod
+    def column_names(table: Any) -> List[Any]:
+        if Columnar.is_spec(table):
+            table = table["columns"]
+        return list(table.column_names) if Columnar.is_batch(table) else list(table.keys())
+
+    @staticmethod
+    def split(config: Dict[str, Any], data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # Params of every chunk, a single entry when nothing is split.
+        # data stays untouched, it may be reused by the module or the caller
+        settings = config.get("chunked")
+        if not settings:
+            return [data]
+        chunk_rows = Chunked.chunk_rows(settings)
+        tables = [key for key, value in data.items() if Streaming.is_table(value)]
+        if len(tables) != 1:
+            if tables:
+                Logger.print(f"Chunked conversion needs exactly one table, got {tables}", level='warning')
+            return [data]
+        key = tables[0]
+        table = data[key]
+
+        chunks: List[Any] = []
+        if isinstance(table, dict) or Columnar.is_batch(table):
+            names = Chunked.column_names(table)
+            columns, number_formats = Columnar.columns(table)
+            # Generator columns are consumed here, every chunk gets lists
+            columns = [list(column) for column in columns]
+            formats = {
+                name: {"number_format": number_format}
+                for name, number_format in zip(names, number_formats) if number_format
+            }
+            num_rows = max((len(column) for column in columns), default=0)
+            for start in range(0, max(num_rows, 1), chunk_rows):
+                chunks.append({
+                    "columns": {
+                        name: column[start:start + chunk_rows]
+                        for name, column in zip(names, columns)
+                    },
+                    "formats": formats
+                })
+        else:
+            rows = list(table)
+            for start in range(0, max(len(rows), 1), chunk_rows):
+                chunks.append(iter(rows[start:start + chunk_rows]))
+
+        if len(chunks) > 1:
+            Logger.print(f"Split table {key} into {len(chunks)} chunks of {chunk_rows} rows")
+        return [data | {key: chunk} for chunk in chunks]
+
+    @staticmethod
+    def convert(
+        xlsx_file: str,
+        out_dir: str,
+        libreoffice_path: str,
+        pool_config: Optional[Dict[str, Any]],
+        profiles: "queue.Queue[str]"
+    ) -> str:
+        pool = ConverterPool.usable(libreoffice_path, pool_config)
+        if pool:
+            return pool.convert(xlsx_file, out_dir)
+
+        # soffice instances with separate profiles run side by side
+        profile = profiles.get()
+        try:
+            subprocess.run(
+                [
+                    libreoffice_path,
+                    '--headless',
+                    f'-env:UserInstallation={_file_url(profile)}',
+                    '--convert-to', 'pdf',
+                    '--outdir', os.path.abspath(out_dir),
+                    os.path.abspath(xlsx_file)
+                ],
+                capture_output=True,
+                check=True
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            Logger.print(f"Error converting {xlsx_file} to pdf: {e}", level='error')
+            raise FileExistsError(f"Error converting xlsx to pdf {e}")
+        finally:
+            profiles.put(profile)
+        return os.path.join(
+            os.path.abspath(out_dir),
+            f"{os.path.splitext(os.path.basename(xlsx_file))[0]}.pdf"
+        )
+
+    @staticmethod
+    def concat(pdf_files: List[str], output_pdf: str) -> None:
+        from PyPDF2 import PdfReader, PdfWriter
+
+        # Pages are copied as they are, watermark and metadata come later once
+        writer = PdfWriter()
+        for pdf_file in pdf_files:
+            for page in PdfReader(pdf_file).pages:
+                writer.add_page(page)
+        with open(output_pdf, "wb") as f:
+            writer.write(f)
+
+    @staticmethod
+    def render(config: Dict[str, Any], scratch: str, chunks: List[Dict[str, Any]]) -> str:
+        from templator import Templator
+
+        settings = config["chunked"]
+        workers = max(1, int(settings.get("workers") or os.cpu_count() or 1))
+        profiles: "queue.Queue[str]" = queue.Queue()
+        for idx in range(workers):
+            profiles.put(os.path.join(scratch, f"profile_{idx}"))
+
+        futures = []
+        # Chunk N+1 is filled while the chunks before it are converting
+        with ThreadPoolExecutor(workers, thread_name_prefix="chunk") as executor:
+            for idx, params in enumerate(chunks):
+                with Metrics.stage("fill"):
+                    xlsx_file = Templator.create_xlsx_from_template(
+                        config.get("report_path"),
+                        params,
+                        scratch,
+                        f"chunk_{idx:05d}.xlsx",
+                        cut_below_tables=idx < len(chunks) - 1,
+                        template_cache=config.get("template_cache")
+                    )
+                futures.append(executor.submit(
+                    Chunked.convert,
+                    xlsx_file,
+                    scratch,
+                    config.get("libreoffice_path"),
+                    config.get("converter_pool"),
+                    profiles
+                ))
+            with Metrics.stage("convert"):
+                pdf_files = [future.result() for future in futures]
+
+        with Metrics.stage("concat"):
+            combined = os.path.join(scratch, f"{os.path.basename(scratch)}.pdf")
+            Chunked.concat(pdf_files, combined)
+        for pdf_file in pdf_files:
+            os.remove(pdf_file)
+        return combined
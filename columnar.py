@@ -0,0 +1,104 @@
+import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Keys of a table spec: {"columns": <dict of columns or record batch>, "formats": {...}}
+SPEC_KEYS = {"columns", "formats"}
+
+class Columnar:
+    @staticmethod
+    def is_batch(value: Any) -> bool:
+        # pyarrow RecordBatch/Table and anything shaped like them
+        return hasattr(value, "column_names") and callable(getattr(value, "column", None))
+
+    @staticmethod
+    def is_spec(value: Any) -> bool:
+        # A plain table may have a column named "columns", a spec holds columns in it
+        if not isinstance(value, dict) or "columns" not in value or not set(value) <= SPEC_KEYS:
+            return False
+        columns = value["columns"]
+        return isinstance(columns, dict) or Columnar.is_batch(columns)
+
+    @staticmethod
+    def to_list(column: Any) -> Any:
+        # One C level conversion for the whole column instead of a Python loop
+        if hasattr(column, "to_pylist"):
+            return column.to_pylist()
+        dtype = getattr(column, "dtype", None)
+        if dtype is not None and hasattr(column, "tolist"):
+            if dtype.kind == "M":
+                # datetime64[ns].tolist() gives ints, microseconds give datetimes
+                column = column.astype("datetime64[us]")
+            values = column.tolist()
+            return Columnar.drop_nan(values) if dtype.kind == "f" else values
+        if hasattr(column, "typecode") and hasattr(column, "tolist"):
+            values = column.tolist()
+            return Columnar.drop_nan(values) if column.typecode in "fd" else values
+        return column
+
+    @staticmethod
+    def drop_nan(values: List[Any]) -> List[Any]:
+        # NaN has no xlsx representation, the cell stays empty
+        return [None if value != value else value for value in values]
+
+    @staticmethod
+    def decimals_format(decimals: int) -> str:
+        return "0" if decimals <= 0 else "0." + "0" * decimals
+
+    @staticmethod
+    def format_column(column: Any, spec: Dict[str, Any]) -> Tuple[Any, Optional[str]]:
+        number_format = spec.get("number_format")
+        decimals = spec.get("decimals")
+        if decimals is not None:
+            if hasattr(column, "round") and getattr(column, "dtype", None) is not None:
+                column = column.round(decimals)
+                values = Columnar.to_list(column)
+            else:
+                values = [
+                    value if value is None else round(value, decimals)
+                    for value in Columnar.to_list(column)
+                ]
+            return values, number_format or Columnar.decimals_format(decimals)
+
+        if spec.get("date_format"):
+            values = [
+                datetime.datetime.fromisoformat(value) if isinstance(value, str) and value else value
+                for value in Columnar.to_list(column)
+            ]
+            return values, spec["date_format"]
+
+        values = Columnar.to_list(column)
+        return values, number_format or Columnar.default_format(values)
+
+    @staticmethod
+    def default_format(values: Any) -> Optional[str]:
+        # The column style replaces the format openpyxl picks for dates itself
+        if not isinstance(values, list):
+            return None
+        first = next((value for value in values if value is not None), None)
+        if isinstance(first, datetime.datetime):
+            return "yyyy-mm-dd h:mm:ss"
+        if isinstance(first, datetime.date):
+            return "yyyy-mm-dd"
+        return None
+
+    @staticmethod
+    def columns(table: Any) -> Tuple[List[Iterable[Any]], List[Optional[str]]]:
+        formats: Dict[str, Dict[str, Any]] = {}
+        if Columnar.is_spec(table):
+            formats = table.get("formats") or {}
+            table = table["columns"]
+
+        if Columnar.is_batch(table):
+            names = list(table.column_names)
+            raw = [table.column(idx) for idx in range(len(names))]
+        else:
+            names = list(table.keys())
+            raw = list(table.values())
+
+        columns: List[Iterable[Any]] = []
+        number_formats: List[Optional[str]] = []
+        for name, column in zip(names, raw):
+            values, number_format = Columnar.format_column(column, formats.get(name) or {})
+            columns.append(values)
+            number_formats.append(number_format)
+        return columns, number_formats
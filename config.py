@@ -1,29 +1,82 @@
 import argparse
 import json
 import os
+import threading
 from typing import Any, Dict, Optional
 from logger import Logger
 
+# Keys of a report entry that point to files
+REPORT_FILES = ("path_to_report", "path_to_py_module", "path_to_watermark")
+
 class Config:
+    # abspath of config.json -> {"mtime_ns", "size", "config", "reports", "checked"}
+    _loaded: Dict[str, Dict[str, Any]] = {}
+    _lock = threading.Lock()
+
     @staticmethod
     def load_config(
-        config_path:str
+        config_path:str = "config.json"
+    ) -> Dict[str, Any]:
+        return Config.registry(config_path)["config"]
+
+    @staticmethod
+    def registry(
+        config_path:str = "config.json"
     ) -> Dict[str, Any]:
-        if not os.path.isfile(config_path):
+        path = os.path.abspath(config_path)
+        try:
+            stat = os.stat(path)
+        except OSError:
             Logger.print(f"Config file not found at {config_path}", level="critical")
-            raise FileNotFoundError(f"")
-        
-        with open(config_path, "r", encoding="utf-8") as config_file:
-            return json.load(config_file)
-        
+            raise FileNotFoundError(f"Config file not found at {config_path}")
+
+        with Config._lock:
+            entry = Config._loaded.get(path)
+            if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                return entry
+            if entry:
+                Logger.print(f"Config file {config_path} changed, reloading")
+
+            with open(path, "r", encoding="utf-8") as config_file:
+                config = json.load(config_file)
+            entry = {
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "config": config,
+                "reports": {item["report_name"]: item for item in config.get("reports", [])},
+                "checked": {}
+            }
+            # Every file the config points to is checked once per load
+            for item in entry["reports"].values():
+                for key in REPORT_FILES:
+                    if item.get(key):
+                        Config.check_path(entry, item[key])
+            if config.get("libreoffice_calc_path"):
+                Config.check_path(entry, config["libreoffice_calc_path"])
+            Config._loaded[path] = entry
+            return entry
+
     @staticmethod
-    def validate_path(full_path:str) -> None:
+    def path_error(full_path:str) -> Optional[Exception]:
         if not os.path.isfile(full_path):
-            Logger.print(f"Required file {full_path} not found", level="critical")
-            raise FileNotFoundError(f"Required file {full_path} not found")
+            return FileNotFoundError(f"Required file {full_path} not found")
         if not os.access(full_path, os.R_OK):
-            Logger.print(f"File {full_path} is not readable", level="critical")
-            raise PermissionError(f"File {full_path} is not readable")
+            return PermissionError(f"File {full_path} is not readable")
+        return None
+
+    @staticmethod
+    def check_path(entry: Dict[str, Any], full_path:str) -> Optional[Exception]:
+        if full_path not in entry["checked"]:
+            entry["checked"][full_path] = Config.path_error(full_path)
+        return entry["checked"][full_path]
+
+    @staticmethod
+    def validate_path(full_path:str, entry: Optional[Dict[str, Any]] = None) -> None:
+        # With a registry entry the result of the load time check is used
+        error = Config.check_path(entry, full_path) if entry else Config.path_error(full_path)
+        if error:
+            Logger.print(str(error), level="critical")
+            raise type(error)(str(error))
         
     @staticmethod
     def validate_out_path(out_path:str):
@@ -52,41 +105,39 @@ class Config:
         out: Optional[str] = None,
         data_was_prepared: Optional[bool] = False,
         params: Optional[Dict[str, any]] = None,
-        metadata: Optional[Dict[str, any]] = None
+        metadata: Optional[Dict[str, any]] = None,
+        stream: Optional[bool] = None
     ):
-        config:Dict[str, Any] = Config.load_config()
+        registry = Config.registry()
+        config:Dict[str, Any] = registry["config"]
+        report_entry:Dict[str, Any] = registry["reports"].get(report, {})
         if not report_path:
-            report_path = next(
-                (item["path_to_report"] for item in config.get("reports", []) \
-                 if item["report_name"] == report),
-                 None
-            )
+            report_path = report_entry.get("path_to_report")
             if not report_path:
                 Logger.print(f"Report path {report} not found in config.json", level='critical')
                 raise ValueError(f"Report path {report} not found in config.json")
-        Config.validate_path(report_path)
+            Config.validate_path(report_path, registry)
+        else:
+            Config.validate_path(report_path)
 
         if not data_was_prepared:
             if not path_to_py_module:
-                path_to_py_module = next(
-                    (item["path_to_py_module"] for item in config.get("reports", []) \
-                     if item["report_name"] == report),
-                     None
-                )
+                path_to_py_module = report_entry.get("path_to_py_module")
                 if not path_to_py_module:
                     Logger.print(f"Path to py modyle {report} not found in config.json", level='critical')
                     raise ValueError(f"Path to py modyle {report} not found in config.json")
-                Config.validate_path(path_to_py_module)
+                Config.validate_path(path_to_py_module, registry)
 
         if not path_to_watermark:
-            path_to_watermark = next(
-                (item["path_to_watermark"] for item in config.get("reports", []) \
-                 if item["report_name"] == report),
-                 None
-            )
-        if(path_to_watermark):
+            path_to_watermark = report_entry.get("path_to_watermark")
+            if path_to_watermark:
+                Config.validate_path(path_to_watermark, registry)
+        else:
             Config.validate_path(path_to_watermark)
 
+        if stream is None:
+            stream = report_entry.get("stream", False)
+
         if not out:
             out = config.get("default_out")
             if not out:
@@ -98,7 +149,7 @@ class Config:
         if not libreoffice:
             Logger.print("libreoffice_calc_path is not found in config.json", level='critical')
             raise ValueError("libreoffice_calc_path is not found in config.json")
-        Config.validate_path(libreoffice)
+        Config.validate_path(libreoffice, registry)
         
         Config.validate_params(params or {})
 
@@ -107,7 +158,8 @@ class Config:
         if not default_metadata:
             Logger.print("default_metadata is not found in config.json", level='warning')
         if not metadata:
-            metadata = default_metadata
+            # A copy, the parsed config is shared by every render
+            metadata = dict(default_metadata or {})
         else:
             metadata.update(default_metadata)
         Config.validate_params(metadata)
@@ -118,7 +170,16 @@ class Config:
             "path_to_py_module": path_to_py_module,
             "path_to_watermark": path_to_watermark,
             "output": out,
+            "scratch_dir": config.get("scratch_dir"),
             "libreoffice_path": libreoffice,
+            "converter_pool": config.get("converter_pool"),
+            "render_cache": config.get("render_cache"),
+            "template_cache": config.get("template_cache"),
+            "metrics": config.get("metrics"),
+            "chunked": report_entry.get("chunked"),
+            "page_numbers": report_entry.get("page_numbers"),
+            "data_was_prepared": data_was_prepared,
+            "stream": bool(stream),
             "params": params or {},
             "metadata": metadata or {}
         }
@@ -127,7 +188,7 @@ class Config:
     def arg_parser():
         parser = argparse.ArgumentParser(
             description=(
-                "A tool to process and generate",
+                "A tool to process and generate "
                 "pdf reports based on xlsx templates"
             )
         )
@@ -137,9 +198,72 @@ class Config:
             parser.add_argument(
                 "--report",
                 type=str,
-                required=True,
+                required=False,
                 help="The name of the report"
             )
+            parser.add_argument(
+                "--jobs",
+                type=str,
+                required=False,
+                help="The path to jsonl manifest, one report job per line"
+            )
+            parser.add_argument(
+                "--parallel",
+                type=int,
+                default=1,
+                help="Number of processes filling templates (--jobs mode), 0 for all cores"
+            )
+            parser.add_argument(
+                "--pipeline",
+                action="store_true",
+                help="Overlap data, fill, convert and finalize of different jobs (--jobs mode)"
+            )
+            parser.add_argument(
+                "--bundle",
+                type=str,
+                help="Append every report of --jobs to this one pdf with a bookmark per report"
+            )
+            parser.add_argument(
+                "--serve",
+                action="store_true",
+                help="Run as render server with a local http api"
+            )
+            parser.add_argument(
+                "--host",
+                type=str,
+                default="127.0.0.1",
+                help="The host the render server listens on (--serve mode)"
+            )
+            parser.add_argument(
+                "--port",
+                type=int,
+                default=8765,
+                help="The port the render server listens on (--serve mode)"
+            )
+            parser.add_argument(
+                "--socket",
+                type=str,
+                required=False,
+                help="Unix socket path, used instead of host and port (--serve mode)"
+            )
+            parser.add_argument(
+                "--workers",
+                type=int,
+                default=2,
+                help="Number of jobs rendered at the same time (--serve mode)"
+            )
+            parser.add_argument(
+                "--queue_size",
+                type=int,
+                default=100,
+                help="Number of jobs waiting before new ones are rejected (--serve mode)"
+            )
+            parser.add_argument(
+                "--results",
+                type=str,
+                required=False,
+                help="The path to jsonl with per job results (--jobs mode)"
+            )
             parser.add_argument(
                 "--report_path",
                 type=str,
@@ -175,8 +299,24 @@ class Config:
                 type=json.loads,
                 required=False,
                 default={},
-                help={"Value for py module or directly xlsx(if data was prepared true)"}
+                help="Value for py module or directly xlsx(if data was prepared true)"
             ),
+            parser.add_argument(
+                "--stream",
+                action="store_true",
+                default=None,
+                help="Write the xlsx row by row, for tables too big for memory"
+            )
+            parser.add_argument(
+                "--startup_report",
+                action="store_true",
+                help="Print how long startup and each import took"
+            )
+            parser.add_argument(
+                "--profile",
+                action="store_true",
+                help="Write a cProfile dump next to the render trace"
+            )
             parser.add_argument(
                 "--metadata",
                 type=json.loads,
@@ -186,16 +326,39 @@ class Config:
 
         add_args()
         args = parser.parse_args()
-        return Config.prepare_config(
+        if args.serve:
+            return {
+                "serve": True,
+                "host": args.host,
+                "port": args.port,
+                "socket": args.socket,
+                "workers": args.workers,
+                "queue_size": args.queue_size
+            }
+        if args.jobs:
+            Config.validate_path(args.jobs)
+            return {
+                "jobs": args.jobs,
+                "results": args.results,
+                "parallel": args.parallel,
+                "pipeline": args.pipeline,
+                "bundle": args.bundle
+            }
+        if not args.report:
+            parser.error("one of the arguments --report --jobs --serve is required")
+        config = Config.prepare_config(
             report=args.report,
             report_path=args.report_path,
             path_to_py_module=args.path_to_py_module,
-            path_to_watermath=args.path_to_watermark,
+            path_to_watermark=args.path_to_watermark,
             out=args.out,
             data_was_prepared= True if str(args.data_was_prepared).lower() == "true" else False,
             params=args.params,
-            metadata=args.metadata
+            metadata=args.metadata,
+            stream=args.stream
         )
+        config["profile"] = args.profile
+        return config
             
                     
 
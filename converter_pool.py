@@ -0,0 +1,299 @@
+import atexit
+import os
+import queue
+import socket
+import subprocess
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from logger import Logger
+
+
+def _file_url(path: str) -> str:
+    path = os.path.abspath(path).replace("\\", "/")
+    if not path.startswith("/"):
+        path = "/" + path
+    return f"file://{path}"
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ConverterWorker:
+    def __init__(
+        self,
+        libreoffice_path: str,
+        profile_dir: str,
+        port: int,
+        startup_timeout: float
+    ):
+        self.libreoffice_path = libreoffice_path
+        self.profile_dir = profile_dir
+        self.port = port
+        self.startup_timeout = startup_timeout
+        self.process: Optional[subprocess.Popen] = None
+        self.desktop = None
+        self.conversions = 0
+
+    def start(self) -> None:
+        # Every instance needs its own profile, otherwise the second
+        # soffice only forwards the request to the first one and exits
+        os.makedirs(self.profile_dir, exist_ok=True)
+        command = [
+            self.libreoffice_path,
+            '--headless',
+            '--invisible',
+            '--nologo',
+            '--nodefault',
+            '--norestore',
+            '--nolockcheck',
+            f'-env:UserInstallation={_file_url(self.profile_dir)}',
+            f'--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext'
+        ]
+        Logger.print(f"Start libreoffice worker on port {self.port}")
+        self.process = subprocess.Popen(
+            command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            self.desktop = self._connect()
+        except BaseException:
+            # A half started instance would stay around with nobody to stop it
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+            raise
+
+    def _connect(self):
+        import uno
+
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver",
+            local_context
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            if self.process.poll() is not None:
+                Logger.print(f"Libreoffice worker on port {self.port} exited on startup", level='error')
+                raise ConnectionError(f"Libreoffice worker on port {self.port} exited on startup")
+            try:
+                context = resolver.resolve(
+                    f"uno:socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext"
+                )
+                return context.ServiceManager.createInstanceWithContext(
+                    "com.sun.star.frame.Desktop",
+                    context
+                )
+            except Exception:
+                if time.monotonic() > deadline:
+                    Logger.print(f"Libreoffice worker on port {self.port} did not start", level='error')
+                    raise ConnectionError(f"Libreoffice worker on port {self.port} did not start")
+                time.sleep(0.25)
+
+    def is_alive(self) -> bool:
+        if not self.process or self.process.poll() is not None or not self.desktop:
+            return False
+        try:
+            self.desktop.getComponents()
+            return True
+        except Exception:
+            return False
+
+    def convert(self, xlsx_file: str, pdf_file: str) -> None:
+        import uno
+        from com.sun.star.beans import PropertyValue
+
+        def props(**kwargs):
+            result = []
+            for name, value in kwargs.items():
+                prop = PropertyValue()
+                prop.Name = name
+                prop.Value = value
+                result.append(prop)
+            return tuple(result)
+
+        document = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(os.path.abspath(xlsx_file)),
+            "_blank",
+            0,
+            props(Hidden=True, ReadOnly=True)
+        )
+        if document is None:
+            raise FileExistsError(f"Libreoffice cannot open {xlsx_file}")
+        try:
+            document.storeToURL(
+                uno.systemPathToFileUrl(os.path.abspath(pdf_file)),
+                props(FilterName="calc_pdf_Export")
+            )
+        finally:
+            document.close(True)
+        self.conversions += 1
+
+    def stop(self) -> None:
+        if self.desktop:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.process:
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+
+    def restart(self) -> None:
+        Logger.print(f"Restart libreoffice worker on port {self.port}", level='warning')
+        self.stop()
+        self.start()
+
+
+class ConverterPool:
+    _instance: Optional["ConverterPool"] = None
+    _instance_lock = threading.Lock()
+    # Why the pool cannot be used, set once so later jobs do not retry
+    _disabled: Optional[str] = None
+
+    def __init__(
+        self,
+        libreoffice_path: str,
+        size: int = 1,
+        profile_dir: Optional[str] = None,
+        base_port: Optional[int] = None,
+        startup_timeout: float = 60,
+        health_check_interval: float = 30
+    ):
+        self.libreoffice_path = libreoffice_path
+        self.profile_dir = os.path.abspath(profile_dir or os.path.join(os.getcwd(), "lo_profiles"))
+        self.workers: List[ConverterWorker] = []
+        self._idle: "queue.Queue[ConverterWorker]" = queue.Queue()
+        self._closed = threading.Event()
+
+        try:
+            for i in range(max(1, size)):
+                worker = ConverterWorker(
+                    libreoffice_path,
+                    os.path.join(self.profile_dir, f"worker_{i}"),
+                    base_port + i if base_port else _free_port(),
+                    startup_timeout
+                )
+                worker.start()
+                self.workers.append(worker)
+                self._idle.put(worker)
+        except BaseException:
+            self.close()
+            raise
+
+        if health_check_interval:
+            threading.Thread(
+                target=self._health_loop,
+                args=(health_check_interval,),
+                daemon=True
+            ).start()
+
+    @staticmethod
+    def available() -> bool:
+        try:
+            import uno
+            return True
+        except ImportError:
+            return False
+
+    @staticmethod
+    def get(
+        libreoffice_path: str,
+        pool_config: Dict[str, Any]
+    ) -> "ConverterPool":
+        with ConverterPool._instance_lock:
+            if ConverterPool._instance is None:
+                ConverterPool._instance = ConverterPool(
+                    libreoffice_path,
+                    size=pool_config.get("size", 1),
+                    profile_dir=pool_config.get("profile_dir"),
+                    base_port=pool_config.get("base_port"),
+                    startup_timeout=pool_config.get("startup_timeout", 60),
+                    health_check_interval=pool_config.get("health_check_interval", 30)
+                )
+                atexit.register(ConverterPool.shutdown)
+            return ConverterPool._instance
+
+    @staticmethod
+    def usable(
+        libreoffice_path: str,
+        pool_config: Optional[Dict[str, Any]]
+    ) -> Optional["ConverterPool"]:
+        # None means one soffice process per call, the reason is logged once
+        if not pool_config or pool_config.get("size", 1) <= 0:
+            return None
+        if ConverterPool._disabled is None and not ConverterPool.available():
+            ConverterPool._disabled = "python uno bridge is not available"
+            Logger.print("Python uno bridge is not available, converter pool is disabled",
+                         level='warning')
+        if ConverterPool._disabled is not None:
+            return None
+        try:
+            return ConverterPool.get(libreoffice_path, pool_config)
+        except Exception as e:
+            ConverterPool._disabled = str(e)
+            Logger.print(f"Converter pool did not start, it is disabled: {e}", level='error')
+            return None
+
+    @staticmethod
+    def shutdown() -> None:
+        with ConverterPool._instance_lock:
+            pool = ConverterPool._instance
+            ConverterPool._instance = None
+        if pool:
+            pool.close()
+
+    def _health_loop(self, interval: float) -> None:
+        while not self._closed.wait(interval):
+            # Only idle workers are checked, busy ones are checked on release
+            for _ in range(self._idle.qsize()):
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    if not worker.is_alive():
+                        worker.restart()
+                except Exception as e:
+                    Logger.print(f"Health check of worker on port {worker.port} failed: {e}", level='error')
+                finally:
+                    self._idle.put(worker)
+
+    def convert(self, xlsx_file: str, out_dir: str) -> str:
+        pdf_file = os.path.join(
+            os.path.abspath(out_dir),
+            f"{os.path.splitext(os.path.basename(xlsx_file))[0]}.pdf"
+        )
+        worker = self._idle.get()
+        try:
+            if not worker.is_alive():
+                worker.restart()
+            try:
+                worker.convert(xlsx_file, pdf_file)
+            except FileExistsError:
+                raise
+            except Exception as e:
+                # The instance most likely crashed on this document,
+                # retry once on a fresh one
+                Logger.print(f"Worker on port {worker.port} failed: {e}", level='warning')
+                worker.restart()
+                worker.convert(xlsx_file, pdf_file)
+        finally:
+            self._idle.put(worker)
+        return pdf_file
+
+    def close(self) -> None:
+        self._closed.set()
+        for worker in self.workers:
+            worker.stop()
@@ -1,13 +1,63 @@
-import datetime 
+import atexit
+import datetime
 import getpass
-import inspect
 import logging
+import logging.handlers
+import multiprocessing
 import os
+import queue
+import reprlib
 import socket
+from typing import Any, Optional
+
+LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+    "critical": logging.CRITICAL
+}
+
+# Longest payload (config, module result) written to the log
+MAX_PAYLOAD = 2000
+
+class Truncated:
+    # Rendered only when the record is actually written
+    _repr = reprlib.Repr()
+    _repr.maxlevel = 4
+    _repr.maxdict = 20
+    _repr.maxlist = 20
+    _repr.maxtuple = 20
+    _repr.maxset = 20
+    _repr.maxstring = 200
+    _repr.maxother = 200
+
+    def __init__(self, value: Any, limit: int = MAX_PAYLOAD):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        text = self.value if isinstance(self.value, str) else Truncated._repr.repr(self.value)
+        if len(text) > self.limit:
+            text = f"{text[:self.limit]}... ({len(text)} chars)"
+        return text
 
 class Logger:
+    _listener: Optional[logging.handlers.QueueListener] = None
+    _handler: Optional[logging.Handler] = None
+    # Process that installed _handler, a forked worker inherits it
+    _pid: Optional[int] = None
+
     @staticmethod
     def setup_logging() -> None:
+        if Logger._pid == os.getpid():
+            return
+        if Logger._handler:
+            # Forked with the parent's queue but not its listener thread,
+            # records put on it would never be written
+            logging.root.removeHandler(Logger._handler)
+            Logger._handler = None
+            Logger._listener = None
         log_dir = os.path.join(
             os.getcwd(),
             "logs"
@@ -18,7 +68,7 @@ class Logger:
         )
         log_file = os.path.join(
             log_dir,
-            f"{datetime,datetime.now().strftime("%Y-%m-%d-%H-%M-%S")}.log"
+            f"{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.log"
         )
 
         username = getpass.getuser()
@@ -29,35 +79,49 @@ class Logger:
             ip_address = socket.gethostbyname(hostname)
         except:
             ip_address = ip_address
-        
-        logging.basicConfig(
-            filename=log_file,
-            filemode='a',
-            format=(
-                f"%(asctime)s - %(levelname)s - User:{username},"
-                f"Host:{hostname}, IP:{ip_address}\n"
-                f"\t %(message)s"
-            )
-        )
+
+        file_handler = logging.FileHandler(log_file, mode='a', encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter(
+            f"%(asctime)s - %(levelname)s - User:{username},"
+            f"Host:{hostname}, IP:{ip_address}\n"
+            f"\t [%(funcName)s] %(message)s"
+        ))
+
+        Logger._pid = os.getpid()
+        if multiprocessing.parent_process() is not None:
+            # Pool workers leave through os._exit without atexit,
+            # so they write directly instead of through a listener
+            Logger._handler = file_handler
+            logging.root.addHandler(file_handler)
+            return
+
+        # Render threads only put records on the queue,
+        # the listener thread does the file I/O
+        records = queue.SimpleQueue()
+        Logger._handler = logging.handlers.QueueHandler(records)
+        logging.root.addHandler(Logger._handler)
+        Logger._listener = logging.handlers.QueueListener(records, file_handler)
+        Logger._listener.start()
+        atexit.register(Logger.stop_logging)
+
+    @staticmethod
+    def stop_logging() -> None:
+        listener, Logger._listener = Logger._listener, None
+        if listener:
+            listener.stop()
+
+    @staticmethod
+    def truncate(value: Any, limit: int = MAX_PAYLOAD) -> Truncated:
+        return Truncated(value, limit)
 
     @staticmethod
-    def print(*args, level="info", **kwargs) -> None:
-        caller = inspect.stack()[1]
-        caller_name = caller.function
-        message = " ".join(str(arg) for arg in args)
-        level = level.lower()
-        if level == "debug":
-            logging.debug(f"[{caller_name}] {message}")
-        elif level == "info":
-            logging.info(f"[{caller_name}] {message}")
-        elif level == "warning":
-            logging.warning(f"[{caller_name}] {message}")
-        elif level == "error":
-            logging.error(f"[{caller_name}] {message}")
-        elif level == "critical":
-            logging.critical(f"[{caller_name}] {message}")
-        else:
-            logging.criticla(f"Unknow logging level {level} from {caller_name}")
-            logging.critical(f"[{caller_name}] {message}")
-        if kwargs.pop("original_print", False):
-            print(f"{message}")
\ No newline at end of file
+    def print(*args, level="info", original_print=False) -> None:
+        level_no = LEVELS.get(level.lower())
+        if level_no is None:
+            logging.critical("Unknow logging level %s", level, stacklevel=2)
+            level_no = logging.CRITICAL
+        if logging.root.isEnabledFor(level_no):
+            # stacklevel=2 makes funcName the caller of Logger.print
+            logging.log(level_no, " ".join(str(arg) for arg in args), stacklevel=2)
+        if original_print:
+            print(" ".join(str(arg) for arg in args))
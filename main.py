@@ -1,10 +1,39 @@
+import multiprocessing
+import sys
+
+from startup import Startup
+
+# Before any other import, so the report sees all of them
+if "--startup_report" in sys.argv:
+    Startup.install()
+
 from logger import Logger
 from config import Config
-from templator import Templator
 
 if __name__ == "__main__":
+    # A spawned --parallel worker of the frozen exe runs main.py again,
+    # it has to become the worker before any arguments are parsed
+    multiprocessing.freeze_support()
     Logger.setup_logging()
     Logger.print("Start report generator")
-    result = Templator.start_gen(Config.arg_parser())
+    config = Config.arg_parser()
+    Startup.mark("ready")
+    if config.get("serve"):
+        from server import RenderServer
+        result = RenderServer.run(config)
+    elif config.get("jobs"):
+        from batch import Batch
+        result = Batch.run(
+            config["jobs"],
+            config.get("results"),
+            config.get("parallel", 1),
+            config.get("pipeline", False),
+            config.get("bundle")
+        )
+    else:
+        # openpyxl and PyPDF2 come with the stages that use them
+        from templator import Templator
+        result = Templator.start_gen(config)
+    Startup.mark("done")
     Logger.print(f"Finish work report generator with {result}")
     print(result)
\ No newline at end of file
@@ -0,0 +1,366 @@
+import cProfile
+import datetime
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from logger import Logger
+
+_current: ContextVar[Optional[Dict[str, Any]]] = ContextVar("render_trace", default=None)
+_stack: ContextVar[Tuple[str, ...]] = ContextVar("render_stage", default=())
+
+PROMETHEUS_LINE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*(?:\{.*\})?)\s+(\S+)$")
+
+# Seconds between two memory samples where the high-water mark cannot be reset
+PEAK_SAMPLE_INTERVAL = 0.02
+
+class Metrics:
+    _lock = threading.Lock()
+    # Jobs measuring their peak right now, only the first one resets the high-water mark
+    _peak_watchers = 0
+    _peak_reset = False
+
+    @staticmethod
+    def peak_rss() -> Optional[int]:
+        # High-water mark of the whole process, in bytes
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == "darwin" else peak * 1024
+        except ImportError:
+            pass
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset
+        except (ImportError, AttributeError):
+            return None
+
+    @staticmethod
+    def current_rss() -> Optional[int]:
+        # Resident memory right now, in bytes
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss
+        except ImportError:
+            pass
+        try:
+            with open("/proc/self/statm", "r") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError, IndexError):
+            return None
+
+    @staticmethod
+    def reset_peak() -> bool:
+        # Linux only, sets VmHWM back to the current RSS
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def hwm_rss() -> Optional[int]:
+        # High-water mark since the last reset_peak, in bytes
+        try:
+            with open("/proc/self/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError, IndexError):
+            pass
+        return None
+
+    @staticmethod
+    @contextmanager
+    def watch_peak(trace: Dict[str, Any]) -> Iterator[None]:
+        with Metrics._lock:
+            if Metrics._peak_watchers == 0:
+                Metrics._peak_reset = Metrics.reset_peak()
+            # Overlapping jobs share the mark the first one reset, each
+            # gets the peak of the process while it ran
+            Metrics._peak_watchers += 1
+            resettable = Metrics._peak_reset
+
+        sampler = None
+        if not resettable:
+            peak = [Metrics.current_rss() or 0]
+            done = threading.Event()
+
+            def sample():
+                while not done.wait(PEAK_SAMPLE_INTERVAL):
+                    peak[0] = max(peak[0], Metrics.current_rss() or 0)
+
+            sampler = threading.Thread(target=sample, name="peak_rss", daemon=True)
+            sampler.start()
+        try:
+            yield
+        finally:
+            if sampler:
+                done.set()
+                sampler.join()
+                rss = max(peak[0], Metrics.current_rss() or 0)
+            else:
+                rss = Metrics.hwm_rss()
+            with Metrics._lock:
+                Metrics._peak_watchers -= 1
+            if rss:
+                trace["peak_rss"] = max(trace.get("peak_rss") or 0, rss)
+
+    @staticmethod
+    @contextmanager
+    def profile(trace: Dict[str, Any]) -> Iterator[None]:
+        if not trace["profile"]:
+            yield
+            return
+        # Only the calling thread is profiled, that is the one running the job
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            # Kept as plain data so worker processes send it back with the trace
+            stats = pstats.Stats()
+            stats.stats = trace.pop("profile_stats", {})
+            stats.add(profiler)
+            trace["profile_stats"] = stats.stats
+
+    @staticmethod
+    @contextmanager
+    def file_lock(path: str) -> Iterator[None]:
+        # Separate CLI runs update the same file, a thread lock does not see them
+        try:
+            import fcntl
+        except ImportError:
+            fcntl = None
+        with open(f"{path}.lock", "a+b") as f:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                import msvcrt
+                while True:
+                    try:
+                        f.seek(0)
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK gives up after 10 seconds, keep waiting
+                        pass
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    @staticmethod
+    def start(config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        settings = config.get("metrics") or {}
+        if not settings and not config.get("profile"):
+            return None
+        trace = {
+            "id": uuid.uuid4().hex,
+            "report": config.get("report_name"),
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "stages": [],
+            "settings": settings,
+            "profile": bool(config.get("profile") or settings.get("profile"))
+        }
+        return trace
+
+    @staticmethod
+    @contextmanager
+    def activate(trace: Optional[Dict[str, Any]]) -> Iterator[Optional[Dict[str, Any]]]:
+        token = _current.set(trace)
+        stack_token = _stack.set(())
+        try:
+            if trace is None:
+                yield trace
+            else:
+                # Every phase of a job runs in here, in whatever thread or process
+                with Metrics.watch_peak(trace), Metrics.profile(trace):
+                    yield trace
+        finally:
+            _stack.reset(stack_token)
+            _current.reset(token)
+
+    @staticmethod
+    def record(
+        trace: Optional[Dict[str, Any]],
+        name: str,
+        wall: float,
+        cpu: float,
+        rss_delta: Optional[int] = None
+    ) -> None:
+        if trace is None:
+            return
+        trace["stages"].append({
+            "stage": name,
+            "wall": round(wall, 6),
+            "cpu": round(cpu, 6),
+            "rss_delta": rss_delta
+        })
+
+    @staticmethod
+    @contextmanager
+    def stage(name: str) -> Iterator[None]:
+        trace = _current.get()
+        if trace is None:
+            yield
+            return
+        stack = _stack.get() + (name,)
+        token = _stack.set(stack)
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        # Process wide, stages running in parallel threads show up in each other
+        rss = Metrics.current_rss()
+        try:
+            yield
+        finally:
+            rss_after = Metrics.current_rss() if rss is not None else None
+            Metrics.record(
+                trace,
+                "/".join(stack),
+                time.perf_counter() - wall,
+                time.thread_time() - cpu,
+                rss_after - rss if rss_after is not None else None
+            )
+            _stack.reset(token)
+
+    @staticmethod
+    @contextmanager
+    def trace(config: Dict[str, Any]) -> Iterator[Optional[Dict[str, Any]]]:
+        trace = Metrics.start(config)
+        if trace is None:
+            yield None
+            return
+
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        status, error = "ok", None
+        try:
+            with Metrics.activate(trace):
+                yield trace
+        except BaseException as e:
+            status, error = "error", str(e)
+            raise
+        finally:
+            trace["wall"] = round(time.perf_counter() - wall, 6)
+            trace["cpu"] = round(time.thread_time() - cpu, 6)
+            Metrics.finish(trace, status, error)
+
+    @staticmethod
+    def finish(
+        trace: Optional[Dict[str, Any]],
+        status: str = "ok",
+        error: Optional[str] = None
+    ) -> None:
+        if trace is None:
+            return
+        trace["status"] = status
+        trace["error"] = error
+        # High-water mark of the process so far, not of this render alone
+        trace["process_peak_rss"] = Metrics.peak_rss()
+        profile_stats = trace.pop("profile_stats", None)
+        if "wall" not in trace:
+            # Assembled from separate phases (batch mode)
+            trace["wall"] = round(sum(s["wall"] for s in trace["stages"] if "/" not in s["stage"]), 6)
+            trace["cpu"] = round(sum(s["cpu"] for s in trace["stages"] if "/" not in s["stage"]), 6)
+        settings = trace.pop("settings")
+
+        trace_dir = settings.get("trace_dir")
+        if trace_dir or profile_stats:
+            trace_dir = trace_dir or os.path.join(os.getcwd(), "traces")
+            base = os.path.join(
+                trace_dir,
+                f"{trace['report']}_{trace['started_at'].replace(':', '-')}_{trace['id'][:8]}"
+            )
+            try:
+                os.makedirs(trace_dir, exist_ok=True)
+                with open(f"{base}.json", "w", encoding="utf-8") as f:
+                    json.dump(trace, f, ensure_ascii=False, indent=1)
+                if profile_stats:
+                    stats = pstats.Stats()
+                    stats.stats = profile_stats
+                    stats.dump_stats(f"{base}.prof")
+            except OSError as e:
+                Logger.print(f"Cannot write render trace {base}: {e}", level='warning')
+
+        if settings.get("prometheus_file"):
+            Metrics.update_prometheus(settings["prometheus_file"], trace)
+
+    @staticmethod
+    def update_prometheus(path: str, trace: Dict[str, Any]) -> None:
+        report = str(trace["report"]).replace("\\", "\\\\").replace('"', '\\"')
+        samples: List[Tuple[str, float, bool]] = [
+            (f'report_render_total{{report="{report}",status="{trace["status"]}"}}', 1, True),
+            (f'report_render_seconds_total{{report="{report}"}}', trace["wall"], True),
+            (f'report_render_cpu_seconds_total{{report="{report}"}}', trace["cpu"], True)
+        ]
+        for stage in trace["stages"]:
+            labels = f'report="{report}",stage="{stage["stage"]}"'
+            samples.append((f"report_stage_seconds_total{{{labels}}}", stage["wall"], True))
+            samples.append((f"report_stage_cpu_seconds_total{{{labels}}}", stage["cpu"], True))
+        peak_rss = trace.get("peak_rss") or trace["process_peak_rss"]
+        if peak_rss:
+            samples.append((f'report_peak_rss_bytes{{report="{report}"}}', peak_rss, False))
+
+        # Counters are summed with what earlier runs left in the file,
+        # the gauge keeps the maximum
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        except OSError as e:
+            Logger.print(f"Cannot write metrics {path}: {e}", level='warning')
+            return
+        with Metrics._lock, Metrics.file_lock(path):
+            values: Dict[str, float] = {}
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        match = PROMETHEUS_LINE.match(line.strip())
+                        if match:
+                            values[match.group(1)] = float(match.group(2))
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                Logger.print(f"Cannot read metrics {path}: {e}", level='warning')
+
+            for name, value, counter in samples:
+                previous = values.get(name, 0.0)
+                values[name] = round(previous + value, 6) if counter else max(previous, value)
+
+            types = {
+                "report_render_total": "counter",
+                "report_render_seconds_total": "counter",
+                "report_render_cpu_seconds_total": "counter",
+                "report_stage_seconds_total": "counter",
+                "report_stage_cpu_seconds_total": "counter",
+                "report_peak_rss_bytes": "gauge"
+            }
+            lines = []
+            for metric, kind in types.items():
+                metric_lines = sorted(
+                    f"{name} {value!r}" for name, value in values.items()
+                    if name.split("{", 1)[0] == metric
+                )
+                if metric_lines:
+                    lines.append(f"# TYPE {metric} {kind}")
+                    lines.extend(metric_lines)
+            try:
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+                os.replace(tmp_path, path)
+            except OSError as e:
+                Logger.print(f"Cannot write metrics {path}: {e}", level='warning')
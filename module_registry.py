@@ -0,0 +1,92 @@
+import atexit
+import hashlib
+import importlib.util
+import os
+import sys
+import threading
+from types import ModuleType
+from typing import Any, Dict
+
+from logger import Logger
+
+class ModuleRegistry:
+    # path -> {"module", "name", "mtime_ns", "size", "sha256"}
+    _modules: Dict[str, Dict[str, Any]] = {}
+    _lock = threading.RLock()
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    @staticmethod
+    def _load(path: str) -> Dict[str, Any]:
+        name = f"report_module_{hashlib.sha1(path.encode('utf-8')).hexdigest()[:12]}"
+        spec = importlib.util.spec_from_file_location(name, path)
+        if not spec:
+            Logger.print(f"cannot load module from {path}", level='critical')
+            raise ImportError(f"cannot load module from {path}")
+
+        module = importlib.util.module_from_spec(spec)
+        # Registered so pickling, dataclasses etc. inside the module work
+        sys.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+            if callable(getattr(module, "setup", None)):
+                Logger.print(f"Setup extended module: {path}")
+                module.setup()
+        except BaseException:
+            sys.modules.pop(name, None)
+            raise
+
+        stat = os.stat(path)
+        return {
+            "module": module,
+            "name": name,
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": ModuleRegistry.file_hash(path)
+        }
+
+    @staticmethod
+    def _unload(path: str, entry: Dict[str, Any]) -> None:
+        module = entry["module"]
+        if callable(getattr(module, "teardown", None)):
+            Logger.print(f"Teardown extended module: {path}")
+            try:
+                module.teardown()
+            except Exception as e:
+                Logger.print(f"Teardown of {path} failed: {e}", level='error')
+        sys.modules.pop(entry["name"], None)
+
+    @staticmethod
+    def get(script_path: str) -> ModuleType:
+        path = os.path.abspath(script_path)
+        stat = os.stat(path)
+        with ModuleRegistry._lock:
+            entry = ModuleRegistry._modules.get(path)
+            if entry:
+                if entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                    return entry["module"]
+                if entry["sha256"] == ModuleRegistry.file_hash(path):
+                    entry["mtime_ns"] = stat.st_mtime_ns
+                    entry["size"] = stat.st_size
+                    return entry["module"]
+                Logger.print(f"Extended module {path} changed, reloading")
+                ModuleRegistry._unload(path, entry)
+                del ModuleRegistry._modules[path]
+
+            entry = ModuleRegistry._load(path)
+            ModuleRegistry._modules[path] = entry
+            return entry["module"]
+
+    @staticmethod
+    def shutdown() -> None:
+        with ModuleRegistry._lock:
+            modules = ModuleRegistry._modules
+            ModuleRegistry._modules = {}
+        for path, entry in modules.items():
+            ModuleRegistry._unload(path, entry)
+
+
+atexit.register(ModuleRegistry.shutdown)
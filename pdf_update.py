@@ -0,0 +1,115 @@
+import os
+import re
+import shutil
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from PyPDF2.generic import (
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    create_string_object,
+    read_object
+)
+
+from logger import Logger
+
+STARTXREF = re.compile(rb"startxref\s+(\d+)\s+%%EOF")
+# The last startxref is within the last kilobytes of a well formed file
+TAIL_SIZE = 4096
+
+class PdfUpdate:
+    @staticmethod
+    def read_trailer(f: BinaryIO) -> Optional[Tuple[int, DictionaryObject, bytes]]:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - TAIL_SIZE))
+        tail = f.read()
+        matches = list(STARTXREF.finditer(tail))
+        if not matches:
+            return None
+        xref_offset = int(matches[-1].group(1))
+
+        # Only a classic xref table is updated here, xref streams get a full rewrite
+        f.seek(xref_offset)
+        if f.read(4) != b"xref":
+            return None
+        while True:
+            line = f.readline()
+            if not line:
+                return None
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if stripped.startswith(b"trailer"):
+                f.seek(f.tell() - len(line) + line.index(b"trailer") + len(b"trailer"))
+                break
+            start_count = stripped.split()
+            if len(start_count) != 2:
+                return None
+            # Every entry of a subsection is exactly 20 bytes
+            f.seek(int(start_count[1]) * 20, os.SEEK_CUR)
+
+        while f.read(1).isspace():
+            pass
+        f.seek(-1, os.SEEK_CUR)
+        trailer = read_object(f, None)
+        if not isinstance(trailer, DictionaryObject):
+            return None
+        return xref_offset, trailer, tail[-1:]
+
+    @staticmethod
+    def append_info(
+        input_pdf: str,
+        output_pdf: str,
+        metadata: Dict[str, str]
+    ) -> bool:
+        # Copies the pdf byte for byte and appends an incremental update
+        # with a new Info dictionary, page content is never parsed
+        with open(input_pdf, "rb") as src:
+            try:
+                found = PdfUpdate.read_trailer(src)
+            except Exception as e:
+                Logger.print(f"Cannot read trailer of {input_pdf}: {e}", level='warning')
+                found = None
+            if not found:
+                return False
+            prev, trailer, last_byte = found
+            if "/Encrypt" in trailer or "/Root" not in trailer or "/Size" not in trailer:
+                return False
+
+            info = DictionaryObject({
+                NameObject(key): create_string_object(str(value))
+                for key, value in metadata.items()
+            })
+            info_num = int(trailer.raw_get("/Size"))
+            new_trailer = DictionaryObject({
+                NameObject("/Size"): NumberObject(info_num + 1),
+                NameObject("/Root"): trailer.raw_get("/Root"),
+                NameObject("/Info"): IndirectObject(info_num, 0, None),
+                NameObject("/Prev"): NumberObject(prev)
+            })
+            if "/ID" in trailer:
+                new_trailer[NameObject("/ID")] = trailer.raw_get("/ID")
+
+            src.seek(0)
+            with open(output_pdf, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+                if last_byte not in (b"\n", b"\r"):
+                    dst.write(b"\n")
+
+                info_offset = dst.tell()
+                dst.write(f"{info_num} 0 obj\n".encode("ascii"))
+                info.write_to_stream(dst, None)
+                dst.write(b"\nendobj\n")
+
+                xref_offset = dst.tell()
+                # Entry 0 heads the free list, readers expect each section to have it
+                dst.write(
+                    f"xref\n0 1\n0000000000 65535 f\r\n"
+                    f"{info_num} 1\n{info_offset:010d} 00000 n\r\n".encode("ascii")
+                )
+                dst.write(b"trailer\n")
+                new_trailer.write_to_stream(dst, None)
+                dst.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+        return True
@@ -0,0 +1,139 @@
+import asyncio
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from batch import Batch
+from logger import Logger
+from metrics import Metrics
+from render_cache import RenderCache
+from templator import Templator
+
+STAGES = ("data", "fill", "convert", "finalize")
+
+class RenderPipeline:
+    def __init__(self, settings: Optional[Dict[str, Any]] = None, bundle: Any = None):
+        settings = settings or {}
+        # With a bundle the finalize stage appends to it in the order jobs finish
+        self.bundle = bundle
+        # Workers per stage, jobs waiting between two stages
+        self.concurrency = {stage: max(1, settings.get(stage) or 1) for stage in STAGES}
+        self.queue_size = max(1, settings.get("queue_size") or 4)
+
+    @staticmethod
+    def data_job(job: Dict[str, Any]) -> None:
+        config = job["config"] = Batch.prepare_job(job["spec"])
+        job["trace"] = Metrics.start(config)
+        with Metrics.activate(job["trace"]), Metrics.stage("data"):
+            job["data"] = Templator.prepare_data(config)
+
+        cache = RenderCache.get(config.get("render_cache"))
+        job["cache_key"] = cache.key(config, job["data"]) if cache else None
+        if job["cache_key"]:
+            output = Templator.result_path(config)
+            if cache.fetch(job["cache_key"], output):
+                job["output"] = output
+                job["cached"] = True
+                del job["data"]
+
+    @staticmethod
+    def fill_job(job: Dict[str, Any]) -> None:
+        job["scratch"] = Templator.make_scratch(job["config"].get("scratch_dir"))
+        with Metrics.activate(job["trace"]), Metrics.stage("fill"):
+            job["xlsx"] = Templator.fill(job["config"], job["scratch"], job.pop("data"))
+
+    @staticmethod
+    def convert_job(job: Dict[str, Any]) -> None:
+        config = job["config"]
+        with Metrics.activate(job["trace"]), Metrics.stage("convert"):
+            job["pdf"] = Templator.excell_to_pdf(
+                job["xlsx"],
+                job["scratch"],
+                config.get("libreoffice_path"),
+                config.get("converter_pool")
+            )
+
+    @staticmethod
+    def finalize_job(job: Dict[str, Any]) -> None:
+        with Metrics.activate(job["trace"]), Metrics.stage("finalize"):
+            job["output"] = Templator.finalize_pdf(job["pdf"], job["config"])
+        if job.get("cache_key"):
+            RenderCache.get(job["config"].get("render_cache")).store(job["cache_key"], job["output"])
+        shutil.rmtree(job.pop("scratch"), ignore_errors=True)
+
+    def bundle_job(self, job: Dict[str, Any]) -> None:
+        Batch.bundle_job(job, self.bundle)
+        if job.get("scratch"):
+            shutil.rmtree(job.pop("scratch"), ignore_errors=True)
+
+    async def stage_worker(
+        self,
+        run: Callable[[Dict[str, Any]], None],
+        executor: ThreadPoolExecutor,
+        inbox: asyncio.Queue,
+        outbox: Optional[asyncio.Queue]
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await inbox.get()
+            # Failed and cached jobs only pass through, a bundle takes cached ones too
+            if "error" not in job and (not job.get("cached") or run == self.bundle_job):
+                started = time.perf_counter()
+                try:
+                    await loop.run_in_executor(executor, run, job)
+                except Exception as e:
+                    Logger.print(f"Job at line {job['line']} failed: {e}", level='error')
+                    job["error"] = str(e)
+                    job.pop("data", None)
+                    if job.get("scratch"):
+                        shutil.rmtree(job.pop("scratch"), ignore_errors=True)
+                job["elapsed"] += time.perf_counter() - started
+            if outbox is not None:
+                # Waits while the next stage is full, that is the backpressure
+                await outbox.put(job)
+            inbox.task_done()
+
+    async def run_async(self, jobs: List[Dict[str, Any]]) -> None:
+        runs = {
+            "data": RenderPipeline.data_job,
+            "fill": RenderPipeline.fill_job,
+            "convert": RenderPipeline.convert_job,
+            "finalize": self.bundle_job if self.bundle else RenderPipeline.finalize_job
+        }
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in STAGES]
+        executors = [
+            ThreadPoolExecutor(self.concurrency[stage], thread_name_prefix=f"pipeline_{stage}")
+            for stage in STAGES
+        ]
+        workers: List[List[asyncio.Task]] = []
+        for idx, stage in enumerate(STAGES):
+            outbox = queues[idx + 1] if idx + 1 < len(STAGES) else None
+            workers.append([
+                asyncio.create_task(self.stage_worker(runs[stage], executors[idx], queues[idx], outbox))
+                for _ in range(self.concurrency[stage])
+            ])
+
+        try:
+            for job in jobs:
+                await queues[0].put(job)
+            # A stage is drained only after the one before it, so nothing is left behind
+            for queue, stage_workers in zip(queues, workers):
+                await queue.join()
+                for task in stage_workers:
+                    task.cancel()
+        finally:
+            for stage_workers in workers:
+                for task in stage_workers:
+                    task.cancel()
+            for executor in executors:
+                executor.shutdown(wait=True)
+
+    def run(self, jobs: List[Dict[str, Any]]) -> None:
+        Logger.print(f"Run {len(jobs)} jobs through the pipeline with {self.concurrency}")
+        try:
+            asyncio.run(self.run_async(jobs))
+        finally:
+            for job in jobs:
+                if job.get("scratch"):
+                    shutil.rmtree(job.pop("scratch"), ignore_errors=True)
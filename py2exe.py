@@ -1,20 +1,24 @@
 import os
 import shutil
+import sys
 from PyInstaller.__main__ import run
 
 if __name__ == "__main__":
+    # --onefile unpacks itself into a temp dir on every launch,
+    # --onedir starts straight from dist/report_generator
+    onedir = "--onedir" in sys.argv[1:]
     options = [
         'main.py',
-        '--onefile',
+        '--onedir' if onedir else '--onefile',
         '--name=report_generator',
         # '--icon-icon.ico'
     ]
 
     run(options)
 
-    output_dir = os.path.join('dist')
+    output_dir = os.path.join('dist', 'report_generator') if onedir else os.path.join('dist')
     config_file = os.path.join('config.json')
     if os.path.exists(config_file):
         shutil.copy(config_file, output_dir)
-    os.mkdir('./dist/out')
-    os.mkdir('./dist/templates')
\ No newline at end of file
+    os.mkdir(os.path.join(output_dir, 'out'))
+    os.mkdir(os.path.join(output_dir, 'templates'))
\ No newline at end of file
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections.abc import Iterator
+from typing import Any, Dict, Optional, Tuple
+
+from columnar import Columnar
+from logger import Logger
+from version import __version__
+
+class RenderCache:
+    _caches: Dict[str, "RenderCache"] = {}
+    _file_hashes: Dict[str, Tuple[int, int, str]] = {}
+    _lock = threading.Lock()
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: Optional[int] = None,
+        max_age_seconds: Optional[float] = None
+    ):
+        self.path = os.path.abspath(path)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.stats = {"hits": 0, "misses": 0, "bypassed": 0, "stored": 0, "evicted": 0}
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def get(cache_config: Optional[Dict[str, Any]]) -> Optional["RenderCache"]:
+        if not cache_config or not cache_config.get("path"):
+            return None
+        path = os.path.abspath(cache_config["path"])
+        with RenderCache._lock:
+            if path not in RenderCache._caches:
+                RenderCache._caches[path] = RenderCache(
+                    path,
+                    cache_config.get("max_bytes"),
+                    cache_config.get("max_age_seconds")
+                )
+            return RenderCache._caches[path]
+
+    @staticmethod
+    def all_stats() -> Dict[str, Dict[str, int]]:
+        with RenderCache._lock:
+            return {path: dict(cache.stats) for path, cache in RenderCache._caches.items()}
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = RenderCache._file_hashes.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        RenderCache._file_hashes[path] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _canonical(value: Any) -> Any:
+        if isinstance(value, (set, frozenset)):
+            return sorted(value, key=repr)
+        if isinstance(value, Iterator):
+            # Lazy tables cannot be hashed without consuming them
+            raise TypeError("lazy table")
+        # str() of arrays and record batches is abbreviated, hash the full content
+        if Columnar.is_batch(value):
+            return {
+                name: Columnar.to_list(value.column(idx))
+                for idx, name in enumerate(value.column_names)
+            }
+        column = Columnar.to_list(value)
+        if column is not value:
+            return column
+        return str(value)
+
+    def key(self, config: Dict[str, Any], data: Dict[str, Any]) -> Optional[str]:
+        try:
+            data_json = json.dumps(data, sort_keys=True, default=RenderCache._canonical)
+        except (TypeError, ValueError):
+            self._count("bypassed")
+            return None
+
+        watermark = config.get("path_to_watermark")
+        digest = hashlib.sha256()
+        for part in (
+            __version__,
+            RenderCache.file_hash(config.get("report_path")),
+            data_json,
+            RenderCache.file_hash(watermark) if watermark else "",
+            json.dumps(config.get("metadata") or {}, sort_keys=True, default=str),
+            json.dumps(config.get("page_numbers") or {}, sort_keys=True, default=str)
+        ):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.pdf")
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += amount
+
+    @staticmethod
+    def _link_or_copy(source: str, target: str) -> None:
+        try:
+            os.link(source, target)
+        except OSError:
+            # A copy is renamed into place, a link appears at once anyway
+            partial = os.path.join(os.path.dirname(target), f".{os.path.basename(target)}.part")
+            shutil.copyfile(source, partial)
+            os.replace(partial, target)
+
+    def fetch(self, key: str, output_path: str) -> bool:
+        entry = self._entry_path(key)
+        if not os.path.isfile(entry) or self._expired(entry):
+            self._count("misses")
+            return False
+        try:
+            RenderCache._link_or_copy(entry, output_path)
+            # mtime is the last use, eviction drops the least recently used
+            os.utime(entry)
+        except OSError as e:
+            Logger.print(f"Cannot use cached render {entry}: {e}", level='warning')
+            self._count("misses")
+            return False
+        self._count("hits")
+        return True
+
+    def store(self, key: str, pdf_path: str) -> None:
+        entry = self._entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            tmp_path = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+            RenderCache._link_or_copy(pdf_path, tmp_path)
+            os.replace(tmp_path, entry)
+        except OSError as e:
+            Logger.print(f"Cannot store render in cache {entry}: {e}", level='warning')
+            return
+        self._count("stored")
+        self.evict()
+
+    def _expired(self, entry: str, now: Optional[float] = None) -> bool:
+        if not self.max_age_seconds:
+            return False
+        return (now or time.time()) - os.path.getmtime(entry) > self.max_age_seconds
+
+    def evict(self) -> None:
+        if not self.max_bytes and not self.max_age_seconds:
+            return
+        now = time.time()
+        entries = []
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                if not name.endswith(".pdf"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for mtime, size, path in entries:
+            too_old = self.max_age_seconds and now - mtime > self.max_age_seconds
+            too_big = self.max_bytes and total > self.max_bytes
+            if not too_old and not too_big:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        if evicted:
+            Logger.print(f"Evicted {evicted} renders from cache {self.path}")
+            self._count("evicted", evicted)
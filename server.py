@@ -0,0 +1,231 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from logger import Logger
+
+REASONS = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    415: "Unsupported Media Type",
+    500: "Internal Server Error",
+    503: "Service Unavailable"
+}
+
+# Everything else, paths above all, comes from config.json: the module
+# of a report is executed in the server process
+JOB_KEYS = {"report", "params", "metadata", "title"}
+
+class RenderServer:
+    def __init__(
+        self,
+        workers: int = 2,
+        queue_size: int = 100,
+        keep_jobs: int = 1000
+    ):
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.keep_jobs = keep_jobs
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="render")
+        self.jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.queue: Optional[asyncio.Queue] = None
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+
+    @staticmethod
+    def render(spec: Dict[str, Any]) -> str:
+        from batch import Batch
+        from templator import Templator
+
+        return Templator.start_gen(Batch.prepare_job(spec))
+
+    def stats(self) -> Dict[str, Any]:
+        from render_cache import RenderCache
+
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+            "workers": self.workers,
+            "completed": self.completed,
+            "failed": self.failed,
+            "render_cache": RenderCache.all_stats()
+        }
+
+    def public(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: job[key] for key in ("id", "status", "output", "error", "elapsed") if key in job}
+
+    async def worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            job["status"] = "running"
+            self.in_flight += 1
+            started = time.perf_counter()
+            try:
+                job["output"] = await loop.run_in_executor(
+                    self.executor,
+                    RenderServer.render,
+                    job["spec"]
+                )
+                job["status"] = "done"
+                self.completed += 1
+            except Exception as e:
+                Logger.print(f"Job {job['id']} failed: {e}", level='error')
+                job["status"] = "error"
+                job["error"] = str(e)
+                self.failed += 1
+            finally:
+                job["elapsed"] = round(time.perf_counter() - started, 3)
+                self.in_flight -= 1
+                job["done"].set()
+                self.queue.task_done()
+                self.forget_old_jobs()
+
+    def forget_old_jobs(self) -> None:
+        while len(self.jobs) > self.keep_jobs:
+            job_id, job = next(iter(self.jobs.items()))
+            if not job["done"].is_set():
+                break
+            del self.jobs[job_id]
+
+    async def submit(self, spec: Dict[str, Any], wait: bool) -> Tuple[int, Dict[str, Any]]:
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "spec": spec,
+            "done": asyncio.Event()
+        }
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            return 503, {"error": "queue is full", **self.stats()}
+        self.jobs[job["id"]] = job
+        if not wait:
+            return 202, self.public(job)
+        await job["done"].wait()
+        return (200 if job["status"] == "done" else 500), self.public(job)
+
+    async def route(
+        self,
+        method: str,
+        target: str,
+        body: bytes,
+        content_type: str = ""
+    ) -> Tuple[int, Dict[str, Any]]:
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+
+        if url.path == "/health":
+            return 200, {"status": "ok"}
+        if url.path == "/stats":
+            return 200, self.stats()
+        if url.path.startswith("/jobs/"):
+            job = self.jobs.get(url.path[len("/jobs/"):])
+            if not job:
+                return 404, {"error": "unknown job"}
+            return 200, self.public(job)
+        if url.path == "/render":
+            if method != "POST":
+                return 405, {"error": "use POST"}
+            # Browsers send text/plain cross-origin without asking, json needs a preflight
+            if content_type.split(";", 1)[0].strip().lower() != "application/json":
+                return 415, {"error": "use Content-Type: application/json"}
+            try:
+                spec = json.loads(body or b"{}")
+                if not isinstance(spec, dict):
+                    raise ValueError("job must be a json object")
+                unknown = sorted(set(spec) - JOB_KEYS)
+                if unknown:
+                    raise ValueError(f"keys {unknown} are not accepted, allowed are {sorted(JOB_KEYS)}")
+            except ValueError as e:
+                return 400, {"error": f"Invalid job: {e}"}
+            wait = query.get("wait", ["1"])[0].lower() not in ("0", "false", "no")
+            return await self.submit(spec, wait)
+        return 404, {"error": f"unknown path {url.path}"}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode("latin-1").split("\r\n")
+            method, target, _ = lines[0].split(" ", 2)
+            headers = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            status, payload = await self.route(
+                method.upper(),
+                target,
+                body,
+                headers.get("content-type", "")
+            )
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+            status, payload = 400, {"error": f"Bad request: {e}"}
+
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        unix_socket: Optional[str] = None
+    ) -> None:
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        # Keep references, the loop only holds weak ones to tasks
+        worker_tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+        if unix_socket:
+            if os.path.exists(unix_socket):
+                os.remove(unix_socket)
+            server = await asyncio.start_unix_server(self.handle, path=unix_socket)
+            Logger.print(f"Render server listening on {unix_socket}", original_print=True)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            Logger.print(f"Render server listening on http://{host}:{port}", original_print=True)
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in worker_tasks:
+                task.cancel()
+
+    @staticmethod
+    def run(config: Dict[str, Any]) -> str:
+        server = RenderServer(
+            workers=config.get("workers") or 2,
+            queue_size=config.get("queue_size") or 100
+        )
+        try:
+            asyncio.run(server.serve(
+                host=config.get("host") or "127.0.0.1",
+                port=config.get("port") or 8765,
+                unix_socket=config.get("socket")
+            ))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.executor.shutdown(wait=True)
+        return "Render server stopped"
@@ -0,0 +1,55 @@
+import atexit
+import builtins
+import sys
+import time
+from typing import Any, Dict, List
+
+class Startup:
+    # [name, cumulative seconds, self seconds, first imported by a stage after "ready"]
+    _imports: List[List[Any]] = []
+    _marks: Dict[str, float] = {}
+    _started = 0.0
+    _original_import = None
+
+    @staticmethod
+    def install() -> None:
+        # Installed before anything else in main.py, like -X importtime
+        # but it also works in the frozen exe
+        if Startup._original_import:
+            return
+        Startup._started = time.perf_counter()
+        Startup._original_import = builtins.__import__
+        stack: List[List[float]] = []
+
+        def timed_import(name, *args, **kwargs):
+            if name in sys.modules:
+                return Startup._original_import(name, *args, **kwargs)
+            stack.append([0.0])
+            started = time.perf_counter()
+            try:
+                return Startup._original_import(name, *args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                nested = stack.pop()[0]
+                if stack:
+                    stack[-1][0] += elapsed
+                Startup._imports.append([name, elapsed, elapsed - nested, "ready" in Startup._marks])
+
+        builtins.__import__ = timed_import
+        # Also printed when the run fails early, e.g. on a bad config
+        atexit.register(lambda: print(Startup.report(), file=sys.stderr))
+
+    @staticmethod
+    def mark(name: str) -> None:
+        if Startup._original_import:
+            Startup._marks.setdefault(name, time.perf_counter() - Startup._started)
+
+    @staticmethod
+    def report(top: int = 15) -> str:
+        lines = [f"Startup report, python {sys.version.split()[0]}, frozen: {getattr(sys, 'frozen', False)}"]
+        for name, at in sorted(Startup._marks.items(), key=lambda item: item[1]):
+            lines.append(f"  {name:<24}{at * 1000:10.1f} ms")
+        lines.append(f"  {'import':<40}{'self ms':>10}{'cumul ms':>10}")
+        for name, cumulative, own, late in sorted(Startup._imports, key=lambda item: -item[2])[:top]:
+            lines.append(f"  {name + (' (lazy)' if late else ''):<40}{own * 1000:10.1f}{cumulative * 1000:10.1f}")
+        return "\n".join(lines)
@@ -0,0 +1,246 @@
+import os
+from collections.abc import Iterator
+from copy import copy
+from itertools import zip_longest
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from columnar import Columnar
+from logger import Logger
+from template_cache import TemplateCache
+from template_index import TemplateIndex
+
+class Streaming:
+    @staticmethod
+    def is_table(value: Any) -> bool:
+        return isinstance(value, (dict, Iterator)) or Columnar.is_batch(value)
+
+    @staticmethod
+    def iter_table_rows(table_data: Any) -> Tuple[Iterable[Sequence[Any]], List[Optional[str]]]:
+        # Columns are zipped lazily, anything else is taken as rows
+        if isinstance(table_data, dict) or Columnar.is_batch(table_data):
+            columns, number_formats = Columnar.columns(table_data)
+            return zip_longest(*columns, fillvalue=''), number_formats
+        return table_data, []
+
+    @staticmethod
+    def styled_cell(sheet, source, value: Any = None):
+        from openpyxl.cell import WriteOnlyCell
+
+        cell = WriteOnlyCell(sheet, value)
+        if source is not None and source.has_style:
+            cell.font = copy(source.font)
+            cell.fill = copy(source.fill)
+            cell.border = copy(source.border)
+            cell.alignment = copy(source.alignment)
+            cell.protection = copy(source.protection)
+            cell.number_format = source.number_format
+        return cell
+
+    @staticmethod
+    def copy_layout(source, sheet) -> None:
+        # Everything the writer emits before sheetData or after it has to be
+        # in place before the first append
+        for key, dimension in source.column_dimensions.items():
+            target = sheet.column_dimensions[key]
+            target.width = dimension.width
+            target.hidden = dimension.hidden
+            target.min = dimension.min
+            target.max = dimension.max
+        sheet.sheet_format = copy(source.sheet_format)
+        sheet.sheet_properties = copy(source.sheet_properties)
+        for name in source.page_setup.__attrs__:
+            setattr(sheet.page_setup, name, getattr(source.page_setup, name))
+        sheet.page_margins = copy(source.page_margins)
+        sheet.print_options = copy(source.print_options)
+        sheet.HeaderFooter = copy(source.HeaderFooter)
+        if source.print_title_rows:
+            sheet.print_title_rows = source.print_title_rows
+        if source.freeze_panes:
+            sheet.freeze_panes = source.freeze_panes
+
+    @staticmethod
+    def append_row(sheet, out_row: int, cells: List[Any], height: Any) -> None:
+        if height is not None:
+            sheet.row_dimensions[out_row].height = height
+        sheet.append(cells)
+        # The row is written out on append, its dimension is not needed anymore
+        sheet.row_dimensions.pop(out_row, None)
+
+    @staticmethod
+    def copy_sheet(source, sheet) -> None:
+        Streaming.copy_layout(source, sheet)
+        for row_idx, row in enumerate(source.iter_rows(min_row=1, min_col=1), start=1):
+            Streaming.append_row(
+                sheet,
+                row_idx,
+                [Streaming.styled_cell(sheet, cell, cell.value) for cell in row],
+                source.row_dimensions[row_idx].height if row_idx in source.row_dimensions else None
+            )
+        Streaming.copy_ranges(source, sheet, [])
+
+    @staticmethod
+    def shift_range(cell_range, inserted: List[Tuple[int, int]]):
+        from openpyxl.worksheet.cell_range import CellRange
+
+        # Moved down by the rows inserted above it, grown by those inside it
+        shift = sum(n for anchor, n in inserted if anchor < cell_range.min_row)
+        grow = sum(n for anchor, n in inserted if cell_range.min_row <= anchor < cell_range.max_row)
+        return CellRange(
+            min_col=cell_range.min_col,
+            min_row=cell_range.min_row + shift,
+            max_col=cell_range.max_col,
+            max_row=cell_range.max_row + shift + grow
+        )
+
+    @staticmethod
+    def copy_ranges(source, sheet, inserted: List[Tuple[int, int]]) -> None:
+        from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+
+        # Written after sheetData, so they can follow the rows
+        for merged in source.merged_cells.ranges:
+            sheet.merged_cells.add(Streaming.shift_range(merged, inserted))
+
+        for formatting in source.conditional_formatting:
+            ranges = " ".join(Streaming.shift_range(item, inserted).coord for item in formatting.sqref.ranges)
+            for rule in formatting.rules:
+                sheet.conditional_formatting.add(ranges, copy(rule))
+
+        for validation in source.data_validations.dataValidation:
+            validation = copy(validation)
+            validation.sqref = MultiCellRange([
+                Streaming.shift_range(item, inserted) for item in validation.sqref.ranges
+            ])
+            sheet.data_validations.append(validation)
+
+        if source.print_area:
+            # Streamed table rows end up inside the area, also below its last row
+            areas = []
+            for area in source.print_area.split(","):
+                area = CellRange(area.rsplit("!", 1)[-1].replace("$", ""))
+                shift = sum(n for anchor, n in inserted if anchor < area.min_row)
+                grow = sum(n for anchor, n in inserted if area.min_row <= anchor <= area.max_row)
+                area.shift(row_shift=shift)
+                area.expand(down=grow)
+                areas.append(area.coord)
+            sheet.print_area = areas
+
+    @staticmethod
+    def render_sheet(
+        source,
+        sheet,
+        params: Dict[str, Any],
+        entries: List[Dict[str, Any]]
+    ) -> None:
+        from openpyxl.cell import WriteOnlyCell
+
+        from templator import Templator
+
+        missing = set()
+        by_cell: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        anchors: Dict[int, Tuple[int, Any]] = {}
+        for entry in entries:
+            value = params.get(entry["keys"][0])
+            if entry["anchor"] and Streaming.is_table(value):
+                if entry["row"] in anchors:
+                    Logger.print(f"Only one table per row is supported, row {entry['row']}", level='critical')
+                    raise ValueError(f"Only one table per row is supported, row {entry['row']}")
+                anchors[entry["row"]] = (entry["column"], value)
+            else:
+                by_cell[(entry["row"], entry["column"])] = entry
+
+        Streaming.copy_layout(source, sheet)
+        # Rows inserted before a template row, used to move merged ranges
+        inserted: List[Tuple[int, int]] = []
+        out_row = 0
+
+        for row_idx, row in enumerate(source.iter_rows(min_row=1, min_col=1), start=1):
+            height = source.row_dimensions[row_idx].height \
+                if row_idx in source.row_dimensions else None
+
+            cells: List[Any] = []
+            for cell in row:
+                value = cell.value
+                if (row_idx, cell.column) in by_cell and isinstance(value, str):
+                    value = Templator.substitute(value, params, missing)
+                cells.append(Streaming.styled_cell(sheet, cell, value))
+
+            if row_idx not in anchors:
+                out_row += 1
+                Streaming.append_row(sheet, out_row, cells, height)
+                continue
+
+            start_col, table_data = anchors[row_idx]
+            # Column styles come from the header row once, like insert_table
+            style_row = row_idx - 1 if row_idx > 1 else row_idx
+            styles: List[Any] = []
+            count = 0
+            rows, number_formats = Streaming.iter_table_rows(table_data)
+            for values in rows:
+                if not styles:
+                    for col_idx in range(len(values)):
+                        style_cell = Streaming.styled_cell(
+                            sheet,
+                            source.cell(row=style_row, column=start_col + col_idx)
+                        )
+                        if col_idx < len(number_formats) and number_formats[col_idx]:
+                            style_cell.number_format = number_formats[col_idx]
+                        styles.append(style_cell._style)
+                if count:
+                    cells = [None] * (start_col - 1)
+                while len(cells) < start_col - 1 + len(values):
+                    cells.append(None)
+                for col_idx, value in enumerate(values):
+                    cell = WriteOnlyCell(sheet, '' if value is None else value)
+                    if col_idx < len(styles):
+                        cell._style = copy(styles[col_idx])
+                    cells[start_col - 1 + col_idx] = cell
+                count += 1
+                out_row += 1
+                Streaming.append_row(sheet, out_row, cells, height)
+
+            if not count:
+                cells[start_col - 1] = Streaming.styled_cell(sheet, row[start_col - 1])
+                out_row += 1
+                Streaming.append_row(sheet, out_row, cells, height)
+                count = 1
+            inserted.append((row_idx, count - 1))
+
+        Streaming.copy_ranges(source, sheet, inserted)
+
+        if missing:
+            Logger.print(f"No values for placeholders {sorted(missing)}", level='warning')
+
+    @staticmethod
+    def create_xlsx_from_template(
+        template_path:str,
+        params:Dict[str, Any],
+        out_dir:str,
+        result_name:str = "temp.xlsx",
+        template_cache:Optional[Dict[str, Any]] = None
+    ) -> str:
+        from openpyxl import Workbook
+
+        Logger.print("Start streaming temporary xlsx file with data")
+        template = TemplateCache.load(template_path, template_cache)
+        index = TemplateIndex.load(template_path, template)
+
+        wb = Workbook(write_only=True)
+        for source in template.worksheets:
+            sheet = wb.create_sheet(source.title)
+            if source is template.active:
+                Streaming.render_sheet(source, sheet, params, index.get(source.title, []))
+            else:
+                Streaming.copy_sheet(source, sheet)
+        wb.active = template.worksheets.index(template.active)
+        template.close()
+
+        result_path:str = os.path.join(
+            os.path.abspath(out_dir),
+            result_name
+        )
+        try:
+            wb.save(result_path)
+        except Exception as e:
+            Logger.print(f"Error saving temporary file in {result_path}: {e}", level='critical')
+            raise FileExistsError(f"Error saving temporary file in {result_path}")
+        return result_path
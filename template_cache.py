@@ -0,0 +1,93 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from logger import Logger
+
+class TemplateCache:
+    # abspath -> {"mtime_ns", "size", "data"}, least recently used first
+    _cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    _bytes = 0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def load(template_path: str, settings: Optional[Dict[str, Any]] = None):
+        from openpyxl import load_workbook
+
+        if not settings or not settings.get("max_bytes"):
+            return load_workbook(template_path)
+
+        path = os.path.abspath(template_path)
+        stat = os.stat(path)
+        with TemplateCache._lock:
+            entry = TemplateCache._cache.get(path)
+            if entry and (entry["mtime_ns"], entry["size"]) != (stat.st_mtime_ns, stat.st_size):
+                TemplateCache._drop(path)
+                entry = None
+            if entry:
+                TemplateCache._cache.move_to_end(path)
+            data = entry["data"] if entry else None
+
+        if data is not None:
+            # Unpickling builds the objects directly, no unzip and no xml parsing
+            try:
+                return TemplateCache.clone(data)
+            except Exception as e:
+                Logger.print(f"Cannot clone cached template {path}: {e}", level='warning')
+                with TemplateCache._lock:
+                    TemplateCache._drop(path)
+
+        wb = load_workbook(path)
+        if entry is None:
+            # A one-off render never pays for pickling, the second use of a template does
+            with TemplateCache._lock:
+                TemplateCache._cache[path] = {
+                    "mtime_ns": stat.st_mtime_ns,
+                    "size": stat.st_size,
+                    "data": None
+                }
+            return wb
+
+        try:
+            data = pickle.dumps(wb, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            Logger.print(f"Template {path} cannot be cached: {e}", level='warning')
+            return wb
+        TemplateCache._store(path, stat, data, int(settings["max_bytes"]))
+        return wb
+
+    @staticmethod
+    def clone(data: bytes):
+        wb = pickle.loads(data)
+        # DimensionHolder pickles without its factory, missing rows and
+        # columns would raise KeyError instead of being created
+        for sheet in wb.worksheets:
+            sheet.row_dimensions.default_factory = sheet._add_row
+            sheet.column_dimensions.default_factory = sheet._add_column
+        return wb
+
+    @staticmethod
+    def _store(path: str, stat: os.stat_result, data: bytes, max_bytes: int) -> None:
+        if len(data) > max_bytes:
+            Logger.print(f"Template {path} is {len(data)} bytes parsed, above the cache budget", level='warning')
+            return
+        with TemplateCache._lock:
+            TemplateCache._drop(path)
+            TemplateCache._cache[path] = {
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "data": data
+            }
+            TemplateCache._bytes += len(data)
+            while TemplateCache._bytes > max_bytes:
+                evicted = next(iter(TemplateCache._cache))
+                Logger.print(f"Evict template {evicted} from cache")
+                TemplateCache._drop(evicted)
+
+    @staticmethod
+    def _drop(path: str) -> None:
+        entry = TemplateCache._cache.pop(path, None)
+        if entry and entry["data"] is not None:
+            TemplateCache._bytes -= len(entry["data"])
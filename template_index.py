@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+from logger import Logger
+
+PLACEHOLDER = re.compile(r"\{\{([^{}]+?)\}\}")
+
+class TemplateIndex:
+    # Bump when the layout of the stored index changes
+    VERSION = 1
+
+    _cache: Dict[str, Dict[str, Any]] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def index_path(template_path: str) -> str:
+        return f"{template_path}.index.json"
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def scan_sheet(sheet) -> List[Dict[str, Any]]:
+        entries = []
+        for row in sheet.iter_rows():
+            for cell in row:
+                value = cell.value
+                if not isinstance(value, str) or "{{" not in value:
+                    continue
+                keys = PLACEHOLDER.findall(value)
+                if keys:
+                    entries.append({
+                        "row": cell.row,
+                        "column": cell.column,
+                        "keys": keys,
+                        # Only a cell holding a single placeholder can anchor a table
+                        "anchor": PLACEHOLDER.fullmatch(value) is not None
+                    })
+        return entries
+
+    @staticmethod
+    def compile(wb) -> Dict[str, List[Dict[str, Any]]]:
+        return {
+            sheet.title: TemplateIndex.scan_sheet(sheet)
+            for sheet in wb.worksheets
+        }
+
+    @staticmethod
+    def _read(index_path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(index, dict) or index.get("version") != TemplateIndex.VERSION:
+            return None
+        return index
+
+    @staticmethod
+    def _write(index_path: str, index: Dict[str, Any]) -> None:
+        try:
+            tmp_path = f"{index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(index, f, ensure_ascii=False)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            # A read-only template dir only costs a rescan in the next process
+            Logger.print(f"Cannot save template index {index_path}: {e}", level='warning')
+
+    @staticmethod
+    def load(
+        template_path: str,
+        wb
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        template_path = os.path.abspath(template_path)
+        stat = os.stat(template_path)
+
+        with TemplateIndex._lock:
+            index = TemplateIndex._cache.get(template_path)
+        if index and index["mtime_ns"] == stat.st_mtime_ns and index["size"] == stat.st_size:
+            return index["sheets"]
+
+        index_path = TemplateIndex.index_path(template_path)
+        index = TemplateIndex._read(index_path)
+        if index and (index["mtime_ns"] != stat.st_mtime_ns or index["size"] != stat.st_size):
+            # Touched but maybe not changed (copied, checked out again)
+            if index.get("sha256") == TemplateIndex.file_hash(template_path):
+                index["mtime_ns"] = stat.st_mtime_ns
+                index["size"] = stat.st_size
+                TemplateIndex._write(index_path, index)
+            else:
+                index = None
+
+        if not index:
+            Logger.print(f"Compile placeholder index for {template_path}")
+            index = {
+                "version": TemplateIndex.VERSION,
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "sha256": TemplateIndex.file_hash(template_path),
+                "sheets": TemplateIndex.compile(wb)
+            }
+            TemplateIndex._write(index_path, index)
+
+        with TemplateIndex._lock:
+            TemplateIndex._cache[template_path] = index
+        return index["sheets"]
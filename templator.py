@@ -1,61 +1,145 @@
 import datetime
-import importlib
-import importlib.util
 import os
+import shutil
 import subprocess
-from typing import Any, Dict
-
-from openpyxl import load_workbook
-from openpyxl.cell import Cell
-from openpyxl.styles import PatternFill, \
-    Border, \
-    Side, \
-    Alignment, \
-    Protection, \
-    Font 
-from openpyxl.utils import range_boundaries
-
-from PyPDF2 import PageObject, PdfReader, PdfWriter
+import tempfile
+import threading
+import uuid
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from itertools import zip_longest
+from typing import Any, Dict, List, Optional
 
+from chunked import Chunked
+from columnar import Columnar
+from converter_pool import ConverterPool
 from logger import Logger
+from metrics import Metrics
+from module_registry import ModuleRegistry
+from render_cache import RenderCache
+from streaming import Streaming
+from template_cache import TemplateCache
+from template_index import PLACEHOLDER, TemplateIndex
+from xml_fill import XmlFill
 
 class Templator:
+    # soffice instances sharing the default profile cannot run side by side
+    _soffice_lock = threading.Lock()
+
     @staticmethod
     def start_gen(config: Dict[str, Any]) -> str:
         Logger.print("Start generation process")
-        Logger.print(config)
-        
-        temp_xlsx = Templator.create_xlsx_from_template(
+        Logger.print("Config:", Logger.truncate(config))
+
+        with Metrics.trace(config):
+            with Metrics.stage("data"):
+                data = Templator.prepare_data(config)
+            cache = RenderCache.get(config.get("render_cache"))
+            cache_key = cache.key(config, data) if cache else None
+            if cache_key:
+                result_path = Templator.result_path(config)
+                if cache.fetch(cache_key, result_path):
+                    Logger.print(f"\t{result_path} was taken from render cache")
+                    return result_path
+
+            # Every job works in its own dir, so parallel jobs never collide
+            scratch = Templator.make_scratch(config.get("scratch_dir"))
+            try:
+                chunks = Chunked.split(config, data)
+                if len(chunks) > 1:
+                    convert_pdf = Chunked.render(config, scratch, chunks)
+                else:
+                    with Metrics.stage("fill"):
+                        temp_xlsx = Templator.fill(config, scratch, chunks[0])
+                    Logger.print(f"Temporary xlsx {temp_xlsx} was generated")
+
+                    Logger.print("\t Convert xlsx to pdf with libreoffice")
+                    with Metrics.stage("convert"):
+                        convert_pdf = Templator.excell_to_pdf(
+                            temp_xlsx,
+                            scratch,
+                            config.get("libreoffice_path"),
+                            config.get("converter_pool")
+                        )
+                Logger.print(f"\t Pdf file {convert_pdf} was created")
+
+                with Metrics.stage("finalize"):
+                    result_path = Templator.finalize_pdf(convert_pdf, config)
+                if cache_key:
+                    cache.store(cache_key, result_path)
+                return result_path
+            finally:
+                shutil.rmtree(scratch, ignore_errors=True)
+                Logger.print(f"\t{scratch} was deleted")
+
+    @staticmethod
+    def make_scratch(scratch_dir: Optional[str] = None) -> str:
+        # Intermediates stay on local disk, only the result goes to the output dir
+        return tempfile.mkdtemp(
+            prefix=".render_",
+            dir=os.path.abspath(scratch_dir) if scratch_dir else None
+        )
+
+    @staticmethod
+    def fill(
+        config: Dict[str, Any],
+        scratch: str,
+        data: Optional[Dict[str, Any]] = None
+    ) -> str:
+        # Named after the scratch dir: unique even when many jobs
+        # are converted into one dir
+        return Templator.create_xlsx_from_template(
             config.get("report_path"),
-            config.get("params" if \
-                       config.get("data_was_prepared") else \
-                        Templator.dynamic_call(
-                            config.get("path_to_py_module"),
-                            config.get("params")
-                        ),
-                        config.get("output"))
+            Templator.prepare_data(config) if data is None else data,
+            scratch,
+            f"{os.path.basename(scratch).lstrip('.')}.xlsx",
+            stream=config.get("stream", False),
+            template_cache=config.get("template_cache")
         )
-        Logger.print(f"Temporary xlsx {temp_xlsx} was generated")
-        
-        Logger.print("\t Convert xlsx to pdf with libreoffice")
-        convert_pdf = Templator.excell_to_pdf(
-            temp_xlsx,
-            config.get("output"),
-            config.get("libreoffice_path")
+
+    @staticmethod
+    def prepare_data(config: Dict[str, Any]) -> Dict[str, Any]:
+        if config.get("data_was_prepared"):
+            return config.get("params")
+        return Templator.dynamic_call(
+            config.get("path_to_py_module"),
+            config.get("params")
         )
-        Logger.print(f"\t Pdf file {convert_pdf} was created")
-        os.remove(temp_xlsx)
-        Logger.print(f"\t{temp_xlsx} was deleted")
-
-        dir, old_name = os.path.split(convert_pdf)
-        new_name = f"{old_name}_{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.pdf"
-        new_path = os.path.join(dir, new_name)
-        Templator.add_metadata_to_pdf(
-            input_pdf=convert_pdf,
-            output_pdf=new_path,
-            watermark=config.get("path_to_watermark"),
-            metadata=config.get("metadata")
+
+    @staticmethod
+    def result_path(config: Dict[str, Any]) -> str:
+        return os.path.join(
+            os.path.abspath(config.get("output")),
+            f"{config.get('report_name') or 'report'}_"
+            f"{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}_"
+            f"{uuid.uuid4().hex[:8]}.pdf"
         )
+
+    @staticmethod
+    def finalize_pdf(
+        convert_pdf: str,
+        config: Dict[str, Any]
+    ) -> str:
+        old_name = os.path.basename(convert_pdf)
+        new_path = Templator.result_path(config)
+        new_name = os.path.basename(new_path)
+        # Written next to the result and renamed, readers of the output dir
+        # never see a half written pdf
+        partial_path = os.path.join(os.path.dirname(new_path), f".{new_name}.part")
+        try:
+            Templator.add_metadata_to_pdf(
+                input_pdf=convert_pdf,
+                output_pdf=partial_path,
+                watermark_pdf=config.get("path_to_watermark"),
+                metadata=config.get("metadata"),
+                page_numbers=config.get("page_numbers")
+            )
+            os.replace(partial_path, new_path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
         os.remove(convert_pdf)
         Logger.print(f"\t{old_name} was renamed as {new_name}")
         return new_path
@@ -67,86 +151,133 @@ class Templator:
     ) -> Dict[str, Any]:
         Logger.print(f"Calls extended module: {script_path}")
         
-        spec = importlib.spec_from_file_location("dynamic_module", script_path)
-        if not spec:
-            Logger.print(f"cannot load module from {script_path}", level='critical')
-            raise ImportError(f"cannot load module from {script_path}")
-
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
+        # Loaded once per process, reloaded only when the file changes
+        module = ModuleRegistry.get(script_path)
         if not hasattr(module, 'main'):
             Logger.print(f"The script at {script_path} does not have 'main' func", level='critical')
             raise ImportError(f"The script at {script_path} does not have 'main' func")
 
         result = module.main(params)
-        if not isinstance(result, Dict[str, any]):
+        if not isinstance(result, dict):
             Logger.print("The 'main' function must return Dict[str, str] or Dict[str, Dict[str, str[]]]",
                          level='critical')
             raise ValueError("The 'main' function must return Dict[str, str] or Dict[str, Dict[str, str[]]]")
         
-        Logger.print(f"Extended module finished with result {result}")
+        Logger.print("Extended module finished with result", Logger.truncate(result))
         return result
     
     @staticmethod
     def create_xlsx_from_template(
         template_path:str,
         params:Dict[Any, str],
-        out_dir:str
+        out_dir:str,
+        result_name:str = "temp.xlsx",
+        stream:bool = False,
+        cut_below_tables:bool = False,
+        template_cache:Optional[Dict[str, Any]] = None
     ):
+        if stream:
+            return Streaming.create_xlsx_from_template(
+                template_path,
+                params,
+                out_dir,
+                result_name,
+                template_cache
+            )
+        # Scalars only: rewrite the string parts, no openpyxl load/save
+        if XmlFill.can_fill(params):
+            return XmlFill.create_xlsx_from_template(
+                template_path,
+                params,
+                out_dir,
+                result_name
+            )
+
         Logger.print("Start create temporary xlsx file with data")
-        wb = load_workbook(template_path)
-        sheet = wb.active
-        Templator.replace_variables_in_sheet(sheet, params)
+        with Metrics.stage("load"):
+            wb = TemplateCache.load(template_path, template_cache)
+            sheet = wb.active
+            index = TemplateIndex.load(template_path, wb)
+        table_end = Templator.replace_variables_in_sheet(sheet, params, index.get(sheet.title))
+        if cut_below_tables and table_end:
+            Templator.cut_rows_below(sheet, table_end)
 
         result_path:str = os.path.join(
             os.path.abspath(out_dir),
-            "temp.xlsx"
+            result_name
         )
         try:
-            wb.save(result_path)
+            with Metrics.stage("save"):
+                wb.save(result_path)
         except Exception as e:
-            Logger.print(f"Error saving temporary file in {result_path}", level = 'criticla')
-            wb.close
+            Logger.print(f"Error saving temporary file in {result_path}", level = 'critical')
+            wb.close()
             raise FileExistsError(f"Error saving temporary file in {result_path}")
         
-        wb.close
+        wb.close()
         return result_path
     
     @staticmethod
     def replace_variables_in_sheet(
         sheet,
-        params: Dict[str, Any]
+        params: Dict[str, Any],
+        entries: Optional[List[Dict[str, Any]]] = None
     ):
         Logger.print("Replacing variables in sheet")
         dict_queue = []
+        missing = set()
 
-        for row in sheet.iter_rows():
-            for cell in row:
-                if isinstance(cell.value, str):
-                    for key, value in params.items():
-                        placeholder = f'{{{{{key}}}}}'
-                        if placeholder in cell.value:
-                            cell.value = cell.value.replace(
-                                placeholder,
-                                str(value)
-                            )
-                        elif isinstance(value, dict):
-                            dict.queue.append(
-                                (cell.row, 
-                                 cell.column,
-                                 value
-                                 )
-                            )
-                            cell.value = cell.value.replace(placeholder, '')
-                            break
-                        else:
-                            Logger.print(f"Error replace variables sheet with key {key}{value}")
-                            raise ValueError(f"Error replace variables sheet with key {key}{value}")
-        
-        for row, col, value in dict_queue:
-            Templator.insert_table(sheet, row, col, value)
+        # Without a compiled index fall back to a single scan of the sheet
+        if entries is None:
+            entries = TemplateIndex.scan_sheet(sheet)
+
+        with Metrics.stage("replace"):
+            for entry in entries:
+                cell = sheet.cell(row=entry["row"], column=entry["column"])
+                if not isinstance(cell.value, str):
+                    continue
+                if entry["anchor"] and Streaming.is_table(params.get(entry["keys"][0])):
+                    # Each table shifts the rows below it, two on one row would shift them twice
+                    if any(queued[0] == cell.row for queued in dict_queue):
+                        Logger.print(f"Only one table per row is supported, row {cell.row}", level='critical')
+                        raise ValueError(f"Only one table per row is supported, row {cell.row}")
+                    dict_queue.append((cell.row, cell.column, params[entry["keys"][0]]))
+                    cell.value = None
+                    continue
+                cell.value = Templator.substitute(cell.value, params, missing)
+
+        if missing:
+            Logger.print(f"No values for placeholders {sorted(missing)}", level='warning')
+
+        # Bottom up, so inserted rows do not move anchors still in the queue
+        table_end = None
+        with Metrics.stage("tables"):
+            for row, col, value in sorted(dict_queue, key=lambda item: item[:2], reverse=True):
+                rows = max(Templator.insert_table(sheet, row, col, value), 1)
+                # A table inserted above pushes the lowest one further down
+                table_end = row + rows - 1 if table_end is None else table_end + rows - 1
         
         Logger.print("Finish replacing variables in sheet")
+        return table_end
+
+    @staticmethod
+    def substitute(
+        text: str,
+        params: Dict[str, Any],
+        missing: set
+    ) -> str:
+        def replace(match):
+            key = match.group(1)
+            if key not in params:
+                missing.add(key)
+                return match.group(0)
+            value = params[key]
+            if Streaming.is_table(value):
+                Logger.print(f"Table {key} must be the only placeholder in its cell", level='critical')
+                raise ValueError(f"Table {key} must be the only placeholder in its cell")
+            return str(value)
+
+        return PLACEHOLDER.sub(replace, text)
 
     @staticmethod
     def insert_table(
@@ -154,159 +285,209 @@ class Templator:
         start_row:int,
         start_col:int,
         table_data: Dict[str, Any]
-    ) -> None:
+    ) -> int:
         Logger.print(f"Replacing tables in {sheet}:{start_row},{start_col}")
-        columns = list(table_data.values())
-        num_rows = max(len(col) for col in columns)
-
-        # Hash error when try copy style like
-        # target.style = copy(source.style)
-        def copy_style(
-                source: Cell,
-                target: Cell
-        ):
-            try:
-                if source.has_style:
-                    target.fill = PatternFill(
-                        fill_type=source.fill.fill_type,
-                        start_color=source.fill.start_color,
-                        end_color=source.fill.end_color
-                    )
-                    target.font = Font(
-                        name=source.font.name,
-                        size=source.font.size,
-                        bold=source.font.bold,
-                        italic=source.font.italic,
-                        underline=source.font.underline,
-                        strike=source.font.strike,
-                        color=source.font.color
-                    )
-                    target.alignment = Alignment(
-                        horizontal=source.alignment.horizontal,
-                        vertical=source.alignment.vertical,
-                        wrap_text=source.alignment.wrap_text,
-                        shrink_to_fit=source.alignment.shrink_to_fit,
-                        indent=source.alignment.indent,
-                    )
-                    target.border = Border(
-                        left=source.border.left,
-                        right=source.border.right,
-                        top=source.border.top,
-                        bottom=source.border.bottom,
-                        diagonal=source.border.diagonal,
-                        diagonal_direction=source.border.diagonal_direction,
-                        diagonalDown=source.border.diagonalDown,
-                        diagonalUp=source.border.diagonalUp,
-                        vertical=source.border.vertical,
-                        horizontal=source.border.horizontal,
-                        outline=source.border.outline,
-                        start=source.border.start,
-                        end=source.border.end,
-                    )
-                    target.side = Side (
-                        style=source.side.style,
-                        border_style=source.side.border_style
-                    )
-
-                    target.protection = Protection(
-                        locked=source.protection.locked,
-                        hidden=source.protection.hidden,
-                    )
-
-            except Exception as e:
-                Logger.print(f"Error {e}", level="warning")
-
-        original_merges = []
+        number_formats: List[Optional[str]] = []
+        if isinstance(table_data, dict) or Columnar.is_batch(table_data):
+            columns, number_formats = Columnar.columns(table_data)
+            columns = [list(col) for col in columns]
+        else:
+            columns = [list(col) for col in zip_longest(*table_data, fillvalue='')]
+        num_rows = max((len(col) for col in columns), default=0)
+        if not num_rows:
+            Logger.print("End replacing tables")
+            return 0
 
-        for i, x in enumerate(sheet.merged_cells.ranges):
-            original_merges.append(str(x))
+        # The first data row takes the anchor row, the rest is shifted in at once
+        if num_rows > 1:
+            Templator.shift_rows(sheet, start_row + 1, num_rows - 1)
 
-        for i in original_merges:
-            sheet.unmerge_cells(i)
+        # One style per template column, resolved once from the header row.
+        # Copying the StyleArray keeps the workbook's style ids, so no new
+        # Font/Fill/... objects are built (copy(source.style) hits a hash error)
+        style_row = start_row - 1 if start_row > 1 else start_row
+        column_styles = []
+        for col_idx in range(len(columns)):
+            source = sheet.cell(row=style_row, column=start_col + col_idx)
+            style = source._style if source.has_style else None
+            if col_idx < len(number_formats) and number_formats[col_idx]:
+                # The format is registered once, on the first data cell
+                cell = sheet.cell(row=start_row, column=start_col + col_idx)
+                if style is not None:
+                    cell._style = copy(style)
+                cell.number_format = number_formats[col_idx]
+                style = cell._style
+            column_styles.append(style)
 
         for row_idx in range(num_rows):
-            if row_idx == 0:
-                sheet.insert_row(start_row + start_col)
-            
             for col_idx, col_data in enumerate(columns):
                 cell = sheet.cell(
-                    row=start_row,
-                    columns=start_col + col_idx
+                    row=start_row + row_idx,
+                    column=start_col + col_idx
                 )
                 cell.value = col_data[row_idx] if row_idx < len(col_data) else ''
-                copy_style(
-                    sheet.cell(row=start_row - 1, column = start_col + col_idx),
-                    cell
-                )
+                if column_styles[col_idx] is not None:
+                    cell._style = copy(column_styles[col_idx])
+
+        Logger.print("End replacing tables")
+        return num_rows
+
+    @staticmethod
+    def cut_rows_below(sheet, last_row:int) -> None:
+        # Drops what follows the table (totals, signatures), for every chunk but the last
+        for merged in list(sheet.merged_cells.ranges):
+            if merged.max_row > last_row:
+                sheet.merged_cells.remove(merged)
+        if sheet.max_row > last_row:
+            sheet.delete_rows(last_row + 1, sheet.max_row - last_row)
+
+    @staticmethod
+    def shift_rows(
+        sheet,
+        idx:int,
+        amount:int
+    ) -> None:
+        merged = sheet.merged_cells.ranges
+        ranges = sorted(merged, key=lambda item: item.min_row)
+        below = ranges[bisect_left([item.min_row for item in ranges], idx):]
+        # Ranges crossing the insertion point grow with the inserted block
+        crossing = [
+            item for item in ranges[:len(ranges) - len(below)]
+            if item.max_row >= idx
+        ]
+
+        sheet.insert_rows(idx, amount)
+
+        # CellRange hashes by its bounds, so moved ranges leave the set first
+        merged.difference_update(below)
+        for item in below:
+            item.shift(row_shift=amount)
+        merged.update(below)
 
-            sheet.row_dimensions[row_idx].height = sheet.row_dimensions[row_idx-1].height
-
-        for org_merg in original_merges:
-            numeric = range_boundaries(str(org_merg))
-            if(numeric[1] > start_row):
-                start_row_new = numeric[1] + num_rows - 1
-                start_column_new = num_rows[0]
-                end_row_new = numeric[3] + num_rows - 1
-                end_column_new = numeric[2]
-            else:
-                start_row_new = numeric[1]
-                start_column_new = numeric[0]
-                end_row_new = numeric[3]
-                end_column_new = numeric[2]
+        for item in crossing:
+            merged.discard(item)
             sheet.merge_cells(
-                start_row=start_row_new,
-                start_column=start_column_new,
-                end_row=end_row_new,
-                emd_column=end_column_new
+                start_row=item.min_row,
+                start_column=item.min_col,
+                end_row=item.max_row + amount,
+                end_column=item.max_col
             )
-        Logger.print("End replacing tables")
+
+        # insert_rows leaves row heights in place, move them in one pass
+        dimensions = sheet.row_dimensions
+        height = dimensions[idx - 1].height if (idx - 1) in dimensions else None
+        moved = sorted(
+            (row, dimensions.pop(row)) for row in list(dimensions.keys()) if row >= idx
+        )
+        for row, dimension in moved:
+            dimension.index = row + amount
+            dimensions[row + amount] = dimension
+        if height is not None:
+            for row in range(idx, idx + amount):
+                dimensions[row].height = height
 
     @staticmethod
     def excell_to_pdf(
         xlsx_file:str,
         out_dir:str,
-        libreoffice_path:str
+        libreoffice_path:str,
+        pool_config: Optional[Dict[str, Any]] = None
     ) -> str:
-        excell_file = os.path.abspath(xlsx_file)
+        return Templator.excell_to_pdf_many(
+            [xlsx_file],
+            out_dir,
+            libreoffice_path,
+            pool_config
+        )[0]
+
+    @staticmethod
+    def excell_to_pdf_many(
+        xlsx_files:List[str],
+        out_dir:str,
+        libreoffice_path:str,
+        pool_config: Optional[Dict[str, Any]] = None
+    ) -> List[str]:
+        excell_files = [os.path.abspath(xlsx_file) for xlsx_file in xlsx_files]
+        pool = ConverterPool.usable(libreoffice_path, pool_config)
+        if pool:
+            try:
+                if len(excell_files) == 1:
+                    return [pool.convert(excell_files[0], out_dir)]
+                # Keep every worker of the pool busy
+                with ThreadPoolExecutor(len(pool.workers)) as executor:
+                    return list(executor.map(
+                        lambda excell_file: pool.convert(excell_file, out_dir),
+                        excell_files
+                    ))
+            except FileExistsError:
+                raise
+            except Exception as e:
+                Logger.print(f"Error converting xlsx to pdf in pool: {e}", level='error')
+                raise FileExistsError(f"Error converting xlsx to pdf {e}")
+
+        # One soffice invocation accepts any number of input files
         command = [
             libreoffice_path,
             '--headless',
             '--convert-to', 'pdf',
             '--outdir',
             os.path.abspath(out_dir),
-            excell_file
+            *excell_files
         ]
 
         try:
-            subprocess.run(
-                command,
-                capture_output=True,
-                shell=True,
-                check=True
-            )
+            with Templator._soffice_lock:
+                subprocess.run(
+                    command,
+                    capture_output=True,
+                    shell=True,
+                    check=True
+                )
         except subprocess.CalledProcessError as e:
             Logger.print(f"Error converting xlsx to pdf: {e}", level='error')
             raise FileExistsError(f"Error converting xlsx to pdf {e}")
         
-        return str(excell_file).replace("xlsx", "pdf")
+        return [
+            os.path.join(
+                os.path.abspath(out_dir),
+                f"{os.path.splitext(os.path.basename(excell_file))[0]}.pdf"
+            )
+            for excell_file in excell_files
+        ]
     
     @staticmethod
     def add_metadata_to_pdf(
         input_pdf: str,
         output_pdf: str,
         watermark_pdf: str,
-        metadata: Dict[str, str]
+        metadata: Dict[str, str],
+        page_numbers: Optional[Dict[str, Any]] = None
     ) -> None:
+        # PyPDF2 is only needed from here on, a cache hit never imports it
+        from PyPDF2 import PdfReader, PdfWriter
+
+        from pdf_update import PdfUpdate
+        from watermark import Watermark
+
+        # Info keys are pdf names, config.json lists them without the slash
+        metadata = {
+            key if key.startswith("/") else f"/{key}": value
+            for key, value in (metadata or {}).items()
+        }
+        # Without a watermark the pages stay as they are, only Info changes
+        if not watermark_pdf and not page_numbers \
+                and PdfUpdate.append_info(input_pdf, output_pdf, metadata):
+            return
+
         reader = PdfReader(input_pdf)
         writer = PdfWriter()
         writer.add_metadata(metadata)
 
+        for page in reader.pages:
+            writer.add_page(page)
         if(watermark_pdf):
-            watermark_reader = PdfReader(watermark_pdf)
-            watermark_pdf: PageObject = watermark_reader.pages[0]
-
-            for page in reader.pages:
-                page.merge_page(watermark_pdf)
-                writer.add_page(page)
+            Watermark.stamp(writer, watermark_pdf)
+        if page_numbers:
+            Watermark.number_pages(writer, page_numbers)
         with open(output_pdf, 'wb') as f:
             writer.write(f)
\ No newline at end of file
@@ -0,0 +1,139 @@
+import io
+import os
+import threading
+from typing import Any, Dict
+
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    NameObject
+)
+
+from logger import Logger
+
+STAMP_NAME = "/XlsxToPdfWatermark"
+NUMBER_FONT = "/XlsxToPdfPageNumber"
+
+class Watermark:
+    # abspath -> {"mtime_ns", "size", "page", "content", "bbox", "lock"}
+    _cache: Dict[str, Dict[str, Any]] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def load(watermark_path: str) -> Dict[str, Any]:
+        path = os.path.abspath(watermark_path)
+        stat = os.stat(path)
+        with Watermark._lock:
+            entry = Watermark._cache.get(path)
+            if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                return entry
+
+            Logger.print(f"Load watermark {path}")
+            # Read into memory, the reader stays open as long as it is cached
+            with open(path, "rb") as f:
+                reader = PdfReader(io.BytesIO(f.read()))
+            if not reader.pages:
+                Logger.print(f"Watermark {path} has no pages", level='critical')
+                raise ValueError(f"Watermark {path} has no pages")
+            page = reader.pages[0]
+            contents = page.get_contents()
+            entry = {
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "page": page,
+                "content": contents.get_data() if contents is not None else b"",
+                "bbox": [float(value) for value in page.mediabox],
+                "lock": threading.Lock()
+            }
+            Watermark._cache[path] = entry
+            return entry
+
+    @staticmethod
+    def add_form(writer: PdfWriter, entry: Dict[str, Any]) -> Any:
+        stream = DecodedStreamObject()
+        stream.set_data(entry["content"])
+        # flate_encode keeps only the filter, the form keys are set afterwards
+        form = stream.flate_encode()
+        form[NameObject("/Type")] = NameObject("/XObject")
+        form[NameObject("/Subtype")] = NameObject("/Form")
+        form[NameObject("/BBox")] = ArrayObject(FloatObject(value) for value in entry["bbox"])
+        resources = entry["page"].get("/Resources")
+        # Cloning reads fonts/images from the cached reader, one thread at a time
+        with entry["lock"]:
+            form[NameObject("/Resources")] = \
+                resources.get_object().clone(writer) if resources is not None else DictionaryObject()
+        return writer._add_object(form)
+
+    @staticmethod
+    def add_stream(writer: PdfWriter, data: bytes) -> Any:
+        stream = DecodedStreamObject()
+        stream.set_data(data)
+        return writer._add_object(stream)
+
+    @staticmethod
+    def overlay(page: Any, save_ref: Any, draw_ref: Any, category: str, name: str, ref: Any) -> None:
+        # Page contents are only referenced, never decoded or re-encoded
+        contents = page.get("/Contents")
+        if contents is None:
+            streams = []
+        elif isinstance(contents.get_object(), ArrayObject):
+            streams = list(contents.get_object())
+        else:
+            streams = [contents]
+        page[NameObject("/Contents")] = ArrayObject([save_ref, *streams, draw_ref])
+
+        resources = page.get("/Resources")
+        if resources is None:
+            resources = DictionaryObject()
+            page[NameObject("/Resources")] = resources
+        resources = resources.get_object()
+        named = resources.get(category)
+        if named is None:
+            named = DictionaryObject()
+            resources[NameObject(category)] = named
+        named.get_object()[NameObject(name)] = ref
+
+    @staticmethod
+    def stamp(writer: PdfWriter, watermark_path: str) -> None:
+        entry = Watermark.load(watermark_path)
+
+        # One form and two tiny wrapper streams for the whole document
+        form = Watermark.add_form(writer, entry)
+        save_ref = Watermark.add_stream(writer, b"q\n")
+        draw_ref = Watermark.add_stream(writer, f"\nQ\nq {STAMP_NAME} Do Q\n".encode("latin-1"))
+        for page in writer.pages:
+            Watermark.overlay(page, save_ref, draw_ref, "/XObject", STAMP_NAME, form)
+
+    @staticmethod
+    def number_pages(writer: PdfWriter, settings: Dict[str, Any]) -> None:
+        # Numbers are written over the finished document, so they keep
+        # counting across pdfs that were converted separately
+        text_format = settings.get("format") or "{page} / {pages}"
+        size = float(settings.get("size") or 9)
+        font = writer._add_object(DictionaryObject({
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Helvetica"),
+            NameObject("/Encoding"): NameObject("/WinAnsiEncoding")
+        }))
+        save_ref = Watermark.add_stream(writer, b"q\n")
+        pages = len(writer.pages)
+        for number, page in enumerate(writer.pages, start=1):
+            text = text_format.format(page=number, pages=pages)
+            box = page.mediabox
+            # Helvetica digits are half an em wide, close enough to center
+            x = settings.get("x")
+            if x is None:
+                x = (float(box.width) - len(text) * size * 0.5) / 2
+            x = float(box.left) + float(x)
+            y = float(box.bottom) + float(settings.get("y", 20))
+            escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            draw_ref = Watermark.add_stream(
+                writer,
+                f"\nQ\nq BT {NUMBER_FONT} {size:g} Tf {x:.2f} {y:.2f} Td ({escaped}) Tj ET Q\n"
+                .encode("cp1252", "replace")
+            )
+            Watermark.overlay(page, save_ref, draw_ref, "/Font", NUMBER_FONT, font)
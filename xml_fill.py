@@ -0,0 +1,73 @@
+import os
+import re
+import shutil
+import zipfile
+from typing import Any, Dict
+from xml.sax.saxutils import escape, unescape
+
+from logger import Logger
+from streaming import Streaming
+from template_index import PLACEHOLDER
+
+# Parts that can hold cell text: the shared string table and inline strings
+STRING_PARTS = re.compile(r"^xl/(sharedStrings\.xml|worksheets/[^/]+\.xml)$")
+TEXT_ELEMENT = re.compile(r"<t(\s[^>]*)?>([^<]*)</t>")
+
+class XmlFill:
+    @staticmethod
+    def can_fill(params: Dict[str, Any]) -> bool:
+        return not any(Streaming.is_table(value) for value in params.values())
+
+    @staticmethod
+    def fill_part(text: str, params: Dict[str, Any], missing: set) -> str:
+        def replace_placeholder(match):
+            key = unescape(match.group(1))
+            if key not in params:
+                missing.add(key)
+                return match.group(0)
+            return escape(str(params[key]))
+
+        def replace_element(match):
+            attrs, content = match.group(1) or "", match.group(2)
+            if "{{" not in content:
+                return match.group(0)
+            content = PLACEHOLDER.sub(replace_placeholder, content)
+            if content != content.strip() and "xml:space" not in attrs:
+                attrs += ' xml:space="preserve"'
+            return f"<t{attrs}>{content}</t>"
+
+        return TEXT_ELEMENT.sub(replace_element, text)
+
+    @staticmethod
+    def create_xlsx_from_template(
+        template_path:str,
+        params:Dict[str, Any],
+        out_dir:str,
+        result_name:str = "temp.xlsx"
+    ) -> str:
+        Logger.print("Start filling temporary xlsx file on xml level")
+        result_path:str = os.path.join(
+            os.path.abspath(out_dir),
+            result_name
+        )
+        missing = set()
+        try:
+            with zipfile.ZipFile(template_path) as source, \
+                 zipfile.ZipFile(result_path, "w") as result:
+                for info in source.infolist():
+                    if STRING_PARTS.match(info.filename):
+                        data = source.read(info)
+                        if b"{{" in data:
+                            text = XmlFill.fill_part(data.decode("utf-8"), params, missing)
+                            result.writestr(info, text.encode("utf-8"))
+                            continue
+                    # Every other part goes over unchanged
+                    with source.open(info) as src, result.open(info, "w") as dst:
+                        shutil.copyfileobj(src, dst, 1 << 20)
+        except (OSError, zipfile.BadZipFile) as e:
+            Logger.print(f"Error saving temporary file in {result_path}: {e}", level='critical')
+            raise FileExistsError(f"Error saving temporary file in {result_path}")
+
+        if missing:
+            Logger.print(f"No values for placeholders {sorted(missing)}", level='warning')
+        return result_path